@@ -0,0 +1,288 @@
+"""Per-request performance metrics, exported in the Prometheus text format on /metrics.
+
+PerformanceMiddleware times each request, and every SQL query on every database alias
+through an execute wrapper installed on each connection. Code that wants its own phase timed
+wraps it in timed('name'), the TEMPLATES backend below does that for template rendering. Each
+view gets histograms of its duration, query count and time per phase. Phases can overlap, e.g.
+a queryset evaluated inside a template counts as both 'db' and 'template' time.
+
+Streaming responses (e.g. product_feed) run their queries while the body is sent, after the
+middleware has returned: those queries are missing from the view's numbers, and its duration
+only covers the time until the response started.
+
+The numbers live in this process only: with several workers, scrape each of them.
+"""
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+DEFAULT_SLOW_REQUEST_THRESHOLD = 0.5
+DEFAULT_SLOW_REQUEST_QUERIES = 5
+# queries against this table are the session engine's, reported as their own phase
+SESSION_TABLE = 'django_session'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = []
+        self.phases = defaultdict(float)
+
+    def record_query(self, sql, seconds):
+        self.queries.append((seconds, sql))
+        self.phases['session' if SESSION_TABLE in sql else 'db'] += seconds
+
+    def slowest_queries(self, count):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:count]
+
+
+def record_query(execute, sql, params, many, context):
+    # installed on every connection for good, a no-op outside a request. The request is found
+    # through the context variable, which sync_to_async copies into its threads
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# connections are per thread, new ones get the wrapper when they connect
+connection_created.connect(install_query_recorder)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` of the current request, if there is one."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[phase] += time.perf_counter() - started
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Histograms keyed by (metric name, labels), safe to share between request threads."""
+
+    HELP = {
+        'http_request_duration_seconds': 'Time from the first middleware to the response.',
+        'http_request_db_queries': 'SQL queries run by one request, on every database alias.',
+        'http_request_phase_seconds': 'Time one request spent in db, session, template and ml.',
+    }
+    BUCKETS = {
+        'http_request_duration_seconds': DURATION_BUCKETS,
+        'http_request_db_queries': QUERY_COUNT_BUCKETS,
+        'http_request_phase_seconds': DURATION_BUCKETS,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = defaultdict(int)
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.BUCKETS[name])
+            histogram.observe(value)
+
+    def observe_request(self, view, status, duration, metrics):
+        labels = {'view': view}
+        self.observe('http_request_duration_seconds', labels, duration)
+        self.observe('http_request_db_queries', labels, len(metrics.queries))
+        for phase, seconds in metrics.phases.items():
+            self.observe('http_request_phase_seconds', {**labels, 'phase': phase}, seconds)
+        with self._lock:
+            self._responses[(view, f'{status // 100}xx')] += 1
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._responses.clear()
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(
+                (key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()
+            )
+            responses = sorted(self._responses.items())
+
+        lines = []
+        current = None
+        for (name, labels), counts, total, count, buckets in histograms:
+            if name != current:
+                current = name
+                lines += [f'# HELP {name} {self.HELP[name]}', f'# TYPE {name} histogram']
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels, le=format_value(bound))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+        if responses:
+            lines += ['# HELP http_responses_total Responses by view and status class.', '# TYPE http_responses_total counter']
+            for (view, status), count in responses:
+                lines.append(f'http_responses_total{format_labels((("status", status), ("view", view)))} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = MetricsRegistry()
+
+
+class PerformanceMiddleware:
+    """Records every request in the registry above and logs the slow ones with their worst queries.
+
+    Goes first in MIDDLEWARE, so the time includes the other middleware (session loading and saving).
+    Sync and async, so under ASGI it adds no thread switch of its own.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.install_query_recorders()
+
+    def install_query_recorders(self):
+        # the connections this thread already has, connection_created covers the ones opened later
+        for alias in connections:
+            install_query_recorder(connections[alias])
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.install_query_recorders()
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - started, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - started, metrics)
+        return response
+
+    def record(self, request, response, duration, metrics):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        registry.observe_request(view, response.status_code, duration, metrics)
+
+        if duration >= getattr(settings, 'METRICS_SLOW_REQUEST_THRESHOLD', DEFAULT_SLOW_REQUEST_THRESHOLD):
+            self.log_slow_request(request, view, duration, metrics)
+
+    def log_slow_request(self, request, view, duration, metrics):
+        count = getattr(settings, 'METRICS_SLOW_REQUEST_QUERIES', DEFAULT_SLOW_REQUEST_QUERIES)
+        phases = ', '.join(f'{phase} {seconds * 1000:.1f}ms' for phase, seconds in sorted(metrics.phases.items()))
+        worst = ''.join(
+            f'\n  {seconds * 1000:8.1f}ms  {sql[:300]}' for seconds, sql in metrics.slowest_queries(count)
+        )
+        logger.warning(
+            "Slow request %s %s (%s): %.0fms, %d queries (%s)%s",
+            request.method, request.path, view, duration * 1000, len(metrics.queries), phases or 'no phases', worst,
+        )
+
+
+def metrics_view(request):
+    # only for the scraper holding METRICS_TOKEN, the paths and timings are nobody else's business.
+    # Not REMOTE_ADDR: behind a proxy on the same host every request comes from 127.0.0.1
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    given = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not token or not hmac.compare_digest(given.encode(), token.encode()):
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with rendering timed as the 'template' phase."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover all the middleware below
+    'aurora_mart_proj.metrics.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'aurora_mart_proj.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, with render time reported to aurora_mart_proj.metrics
+        'BACKEND': 'aurora_mart_proj.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'aurora_mart_proj/templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -71,16 +74,129 @@ TEMPLATES = [
 WSGI_APPLICATION = 'aurora_mart_proj.wsgi.application'
 
 
+# Performance metrics, per view histograms served in the Prometheus format on /metrics, only to
+# requests sending "Authorization: Bearer <METRICS_TOKEN>" (None turns the endpoint off). Set it
+# in the scraper's config (Prometheus authorization credentials), the client address is no
+# protection behind a reverse proxy
+METRICS_TOKEN = None
+# requests slower than this many seconds are logged with their slowest queries
+METRICS_SLOW_REQUEST_THRESHOLD = 0.5
+METRICS_SLOW_REQUEST_QUERIES = 5
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# run on every new connection: synchronous=NORMAL only fsyncs at checkpoints, and each connection
+# maps up to 256MB of the file and keeps a 64MB page cache. WAL (readers never wait for a writer,
+# and the other way round) is stored in the file and set once by storefront migration 0010
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; '
+    'PRAGMA mmap_size=268435456; PRAGMA cache_size=-65536'
+)
+
+# connections are kept open between requests instead of reopened (and re-tuned) every time.
+# WSGI only: under ASGI (asgi.py) each request may run on a different thread and persistent
+# connections pile up, Django's docs say to turn them off there, so set this to 0
+CONN_MAX_AGE = 600
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+            # writers take the write lock up front and wait up to 20s for it, instead of failing
+            # with "database is locked" when a read transaction has to be upgraded
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # a file rather than shared-cache memory, so threaded tests lock like production SQLite does
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # the same file on its own connections, for catalog reads (storefront.routers)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS + '; PRAGMA query_only=ON',
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['storefront.routers.CatalogReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# local memory is per process: with several workers on one host switch to
+# 'django.core.cache.backends.filebased.FileBasedCache' (or any shared cache) so the catalog
+# version and the profile flag versions (authentication.profiles) are seen by every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'aurora-mart',
     }
 }
 
+# Sessions
+# the cart lives in the session. 'storefront.sessions' serves sessions from the cache above and
+# writes changed ones to the database in the background, at most SESSION_WRITE_BEHIND_INTERVAL
+# seconds of cart changes are lost if a worker dies (0 = write-through). It needs a cache every
+# worker shares, so it is opt-in:
+# SESSION_ENGINE = 'storefront.sessions'
+SESSION_WRITE_BEHIND_INTERVAL = 1.0
+# a request that finds this many sessions waiting flushes them itself
+SESSION_WRITE_BEHIND_MAX_PENDING = 1000
+
+STOREFRONT_GRID_CACHE_TIMEOUT = 60 * 5
+
+# after a catalog change, search suggestions keep using the previous index while a background
+# thread builds the new one (False = the next suggestion request rebuilds it)
+STOREFRONT_SUGGEST_BACKGROUND_REBUILD = True
+
+# route the storefront page and cart views to their async versions (storefront/async_views.py).
+# Opt-in, only worth it when served through asgi.py: under WSGI every async view needs its own
+# event loop, the sync views avoid that
+STOREFRONT_ASYNC_VIEWS = False
+
+
+# Machine learning models, loaded once per worker by authentication.ml.registry
+# and reloaded when the file changes on disk
+
+ML_MODELS = {
+    'preferred_category': BASE_DIR / 'models' / 'b2c_customers_100.joblib',
+}
+
+ML_WARM_MODELS_ON_STARTUP = True
+
+ML_MODEL_RELOAD_CHECK_INTERVAL = 5
+
+# concurrent onboarding predictions are grouped into one predict call per window
+ML_BATCH_MAX_SIZE = 64
+ML_BATCH_MAX_WAIT = 0.005
+# seconds an onboarding waits for its prediction before falling back to 'General'
+ML_PREDICT_TIMEOUT = 1.0
+
+
+# same as ModelBackend, but request.user is loaded together with its UserProfile. ModelBackend
+# stays listed so sessions logged in before ProfileBackend are still valid
+AUTHENTICATION_BACKENDS = [
+    'authentication.backends.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
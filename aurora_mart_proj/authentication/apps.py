@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        # drops the session-cached profile flags when a profile is saved
+        from . import signals  # noqa: F401
+
+        # unpickle the ML models once per worker up front instead of on the first onboarding
+        if getattr(settings, 'ML_WARM_MODELS_ON_STARTUP', False):
+            from .ml import registry
+            registry.warm()
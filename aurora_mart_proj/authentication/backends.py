@@ -0,0 +1,21 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+
+
+class ProfileBackend(ModelBackend):
+    # request.user comes with its UserProfile in the same query, so views never look it up again
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('userprofile').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is None and password is not None:
+            # the password was checked and is wrong. ModelBackend, listed after this one for the
+            # sessions logged in through it, would only hash it a second time
+            raise PermissionDenied
+        return user
@@ -1,39 +1,180 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from django.contrib.auth.hashers import make_password
+from collections import Counter
 import csv
+import hashlib
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
 from authentication.models import UserProfile
+from authentication.profiles import invalidate_profile_flags
+from authentication.signals import profile_signals_disconnected
+
+PROFILE_FIELDS = [
+    'age', 'gender', 'employment_status', 'occupation', 'education',
+    'household_size', 'has_children', 'monthly_income_sgd', 'preferred_category',
+]
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0', ''}
+
+
+def parse_bool(value):
+    # bool('False') is True, so the text has to be read
+    value = (value or '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'not a boolean: {value!r}')
+
+
+def fingerprint(values):
+    # decimals are normalised so '4200.5' and '4200.50' count as the same income
+    parts = [
+        str(value.normalize()) if isinstance(value, Decimal) else str(value)
+        for value in (values[field] for field in PROFILE_FIELDS)
+    ]
+    return hashlib.md5('\x1f'.join(parts).encode()).hexdigest()
+
+
+def parse_row(row):
+    values = {
+        'age': int(row['age']),
+        'gender': row['gender'],
+        'employment_status': row['employment_status'],
+        'occupation': row['occupation'],
+        'education': row['education'],
+        'household_size': int(row['household_size']),
+        'has_children': parse_bool(row['has_children']),
+        'monthly_income_sgd': Decimal(row['monthly_income_sgd'].strip()),
+        'preferred_category': row['preferred_category'] or None,
+    }
+    values['row_fingerprint'] = fingerprint(values)
+    return values
+
 
 class Command(BaseCommand):
     help = "Importing user profile data from CSV file."
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str)
+        parser.add_argument(
+            '--key-column', choices=['username', 'email', 'id'], default='username',
+            help="CSV column naming the user each row belongs to, matched against the same User field.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows per lookup and bulk write.")
+        parser.add_argument(
+            '--update', action='store_true',
+            help="Update existing profiles whose row changed since the last import instead of skipping them.",
+        )
+        parser.add_argument(
+            '--delete-missing', action='store_true',
+            help="The file is the full feed: delete imported profiles whose user is not in it.",
+        )
+
+    def iter_chunks(self, reader, key_column, chunk_size):
+        while True:
+            chunk = {}
+            try:
+                for row in islice(reader, chunk_size):
+                    key = row[key_column].strip()
+                    if key:
+                        chunk[int(key) if key_column == 'id' else key] = parse_row(row)
+            except (KeyError, ValueError, InvalidOperation) as e:
+                raise CommandError(f'Line {reader.line_num}: could not parse row ({e!r}).')
+            if not chunk:
+                return
+            yield chunk
+
+    def write_chunk(self, chunk, key_column, update, counts):
+        # three queries per chunk whatever its size: users, existing profiles, one write
+        user_ids = dict(User.objects.filter(**{f'{key_column}__in': list(chunk)}).values_list(key_column, 'id'))
+        existing = {
+            user_id: (profile_id, row_fingerprint)
+            for user_id, profile_id, row_fingerprint in UserProfile.objects.filter(
+                user_id__in=list(user_ids.values())
+            ).values_list('user_id', 'id', 'row_fingerprint')
+        }
+
+        new_profiles = []
+        changed_profiles = []
+        for key, values in chunk.items():
+            user_id = user_ids.get(key)
+            if user_id is None:
+                continue
+            if user_id not in existing:
+                new_profiles.append(UserProfile(user_id=user_id, is_initial_password=False, **values))
+            elif not update:
+                counts['skipped'] += 1
+            elif existing[user_id][1] == values['row_fingerprint']:
+                # same content as the last import, nothing to write
+                counts['unchanged'] += 1
+            else:
+                changed_profiles.append(UserProfile(id=existing[user_id][0], user_id=user_id, **values))
+
+        if new_profiles or changed_profiles:
+            with transaction.atomic():
+                # a profile created since the lookup is skipped, not a failure
+                UserProfile.objects.bulk_create(new_profiles, ignore_conflicts=True)
+                UserProfile.objects.bulk_update(changed_profiles, PROFILE_FIELDS + ['row_fingerprint'])
+            # bulk writes send no post_save, drop what the users' sessions cached
+            invalidate_profile_flags([profile.user_id for profile in new_profiles + changed_profiles])
+        counts['created'] += len(new_profiles)
+        counts['updated'] += len(changed_profiles)
+        unmatched = [str(key) for key in chunk if key not in user_ids]
+        return user_ids.values(), unmatched
+
+    def delete_missing(self, seen, chunk_size):
+        # only imported profiles, the ones made through onboarding have no fingerprint
+        imported = UserProfile.objects.exclude(row_fingerprint='').values_list('user_id', flat=True)
+        missing = [user_id for user_id in imported.iterator() if user_id not in seen]
+        # one DELETE and one cache write per chunk instead of a post_delete per profile
+        with profile_signals_disconnected():
+            for start in range(0, len(missing), chunk_size):
+                user_ids = missing[start:start + chunk_size]
+                UserProfile.objects.filter(user_id__in=user_ids).delete()
+                invalidate_profile_flags(user_ids)
+        return len(missing)
 
     def handle(self, *args, **kwargs):
-        with open(kwargs['csv_file'], 'r') as file:
+        key_column = kwargs['key_column']
+        chunk_size = kwargs['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        started = time.perf_counter()
+        total = 0
+        counts = Counter()
+        unmatched = []
+        seen = set()
+        with open(kwargs['csv_file'], 'r', newline='') as file:
             # headers to id columns
             reader = csv.DictReader(file)
-            # get all the customers, do not include the superuser
-            customers = User.objects.filter(is_staff=False).order_by('id')
-            users = {user.username : user for user in customers}
-            username = list(users.keys())
-            
-            for index, row in enumerate(reader):
-                user = users[username[index]]
-                UserProfile.objects.get_or_create(
-                    user=user,
-                    defaults={
-                        'age': int(row['age']),
-                        'gender' : row['gender'],
-                        'employment_status' : row['employment_status'],
-                        'occupation' : row['occupation'],
-                        'education' : row['education'],
-                        'household_size' : int(row['household_size']),
-                        'has_children' : bool(row['has_children']),
-                        'monthly_income_sgd' : float(row['monthly_income_sgd']),
-                        'preferred_category' : row['preferred_category'],
-                        'is_initial_password' : False
-                    }
-            )
-        self.stdout.write(self.style.SUCCESS('Successfully imported user profiles from excel file.'))
\ No newline at end of file
+            missing = ({key_column} | set(PROFILE_FIELDS)) - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError(f'Missing columns: {", ".join(sorted(missing))}.')
+
+            for chunk in self.iter_chunks(reader, key_column, chunk_size):
+                user_ids, chunk_unmatched = self.write_chunk(chunk, key_column, kwargs['update'], counts)
+                unmatched += chunk_unmatched
+                total += len(chunk)
+                if kwargs['delete_missing']:
+                    seen.update(user_ids)
+
+        # only after the whole file was read, a file cut short must not delete anything
+        if kwargs['delete_missing']:
+            counts['deleted'] = self.delete_missing(seen, chunk_size)
+
+        if unmatched:
+            self.stderr.write(self.style.WARNING(
+                f'{len(unmatched)} rows name no existing user, e.g. {", ".join(unmatched[:5])}.'
+            ))
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} profiles in {elapsed:.1f}s ({rate:.0f} rows/sec): '
+            f'{counts["created"]} created, {counts["updated"]} updated, {counts["unchanged"]} unchanged, '
+            f'{counts["skipped"]} skipped, {counts["deleted"]} deleted.'
+        ))
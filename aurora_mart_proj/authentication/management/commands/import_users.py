@@ -1,33 +1,141 @@
-from django.core.management.base import BaseCommand
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import os
+import time
+from zipfile import BadZipFile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
-import pandas as pd
+from django.db import transaction
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+def _hash_passwords(passwords):
+    # runs in a pool worker, PBKDF2 is pure CPU so this is what the cores are for
+    return [make_password(password) for password in passwords]
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
 
 class Command(BaseCommand):
     # explanation of what this class does
-    help = "Importing User sensitive information from a CSV file"
-    
+    help = "Importing User sensitive information from an Excel file"
+
     def add_arguments(self, parser):
         parser.add_argument(
             'excel_file',
             type=str,
-            help="The path to the CSV file containing user data.",
+            help="The path to the Excel file containing user data.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help="Users per hashing task and bulk insert.")
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Processes hashing passwords (0 = in-process). Defaults to one per core.",
+        )
+        parser.add_argument(
+            '--existing', choices=['skip', 'update'], default='skip',
+            help="What to do with usernames that already exist: leave them alone or overwrite email and password.",
         )
-    
+
+    def iter_chunks(self, path, chunk_size):
+        # read-only mode streams the sheet row by row instead of loading it all like pd.read_excel
+        try:
+            workbook = load_workbook(path, read_only=True, data_only=True)
+        except (OSError, InvalidFileException, BadZipFile) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_text(cell).lower() for cell in next(rows, ())]
+            missing = {'username', 'email', 'password'} - set(header)
+            if missing:
+                raise CommandError(f'Missing columns: {", ".join(sorted(missing))}.')
+            columns = [header.index(name) for name in ('username', 'email', 'password')]
+
+            while True:
+                chunk = {}
+                for row in islice(rows, chunk_size):
+                    username, email, password = (row[i] if i < len(row) else None for i in columns)
+                    username = _text(username)
+                    if username:
+                        # a username listed twice: the last row wins
+                        chunk[username] = (_text(email), None if password is None else str(password))
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            workbook.close()
+
+    def prepare(self, chunk, update):
+        existing = set(User.objects.filter(username__in=list(chunk)).values_list('username', flat=True))
+        if not update:
+            # nothing to hash for users that are skipped anyway
+            chunk = {username: values for username, values in chunk.items() if username not in existing}
+        return chunk, len(existing)
+
+    def write_chunk(self, chunk, hashes, update):
+        users = [
+            User(username=username, email=email, password=password_hash, is_staff=False)
+            for (username, (email, _)), password_hash in zip(chunk.items(), hashes)
+        ]
+        if not users:
+            return
+        with transaction.atomic():
+            if update:
+                User.objects.bulk_create(
+                    users, update_conflicts=True, unique_fields=['username'], update_fields=['email', 'password'],
+                )
+            else:
+                # a user created since prepare() is skipped rather than failing the chunk
+                User.objects.bulk_create(users, ignore_conflicts=True)
+
     def handle(self, *args, **kwargs):
-        df = pd.read_excel(kwargs['excel_file'], header=0)
-
-        df.columns = df.columns.astype(str).str.strip().str.lower()
-        
-        for index, row in df.iterrows():
-            username = row['username']
-            email = row['email']
-            password = row['password']
-                
-            User.objects.create(
-                username=username,
-                email=email,
-                password=make_password(password),
-                is_staff=False
-            )
-        self.stdout.write(self.style.SUCCESS('Successfully imported users from CSV file.'))
\ No newline at end of file
+        chunk_size = kwargs['chunk_size']
+        workers = kwargs['workers']
+        update = kwargs['existing'] == 'update'
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        started = time.perf_counter()
+        total = existing = 0
+
+        def passwords(chunk):
+            return [password for _, password in chunk.values()]
+
+        if workers > 0:
+            # workers only hash, reading and writing stay in this process
+            with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+                pending = deque()
+                for chunk in self.iter_chunks(kwargs['excel_file'], chunk_size):
+                    total += len(chunk)
+                    chunk, found = self.prepare(chunk, update)
+                    existing += found
+                    pending.append((chunk, pool.submit(_hash_passwords, passwords(chunk))))
+                    # enough queued to keep every worker busy, no more
+                    while len(pending) > workers * 2:
+                        done_chunk, future = pending.popleft()
+                        self.write_chunk(done_chunk, future.result(), update)
+                while pending:
+                    done_chunk, future = pending.popleft()
+                    self.write_chunk(done_chunk, future.result(), update)
+        else:
+            for chunk in self.iter_chunks(kwargs['excel_file'], chunk_size):
+                total += len(chunk)
+                chunk, found = self.prepare(chunk, update)
+                existing += found
+                self.write_chunk(chunk, _hash_passwords(passwords(chunk)), update)
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        action = 'updated' if update else 'skipped'
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} users in {elapsed:.1f}s ({rate:.0f} rows/sec): '
+            f'{total - existing} created, {existing} existing {action}.'
+        ))
@@ -0,0 +1,102 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from joblib import load
+import numpy as np
+
+from authentication.ml import PREFERRED_CATEGORY_MODEL, encode_profile, registry
+from authentication.models import UserProfile
+from authentication.profiles import invalidate_profile_flags
+
+# model of a worker process, loaded once by the pool initializer
+_worker_model = None
+
+
+def _load_worker_model(model_path):
+    global _worker_model
+    _worker_model = load(model_path)
+
+
+def _predict_chunk(rows):
+    return list(_worker_model.predict(np.asarray(rows, dtype=float)))
+
+
+class Command(BaseCommand):
+    help = "Re-predict preferred_category for every user profile after the customer model is retrained."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Profiles per predict/bulk_update.")
+        parser.add_argument('--workers', type=int, default=0, help="Predict in this many processes (0 = in-process).")
+        parser.add_argument('--model', default=PREFERRED_CATEGORY_MODEL, help="Model name from settings.ML_MODELS.")
+        parser.add_argument('--dry-run', action='store_true', help="Predict but do not write anything.")
+
+    def iter_chunks(self, chunk_size):
+        # keyset over the primary key, memory stays at one chunk for any number of profiles
+        last_pk = 0
+        while True:
+            chunk = list(
+                UserProfile.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', 'age', 'gender', 'employment_status', 'monthly_income_sgd', 'preferred_category', 'user_id',
+                )[:chunk_size]
+            )
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield chunk
+
+    def write_chunk(self, chunk, predictions, dry_run):
+        changed = [
+            UserProfile(pk=row[0], user_id=row[6], preferred_category=prediction)
+            for row, prediction in zip(chunk, predictions)
+            if row[5] != prediction
+        ]
+        if changed and not dry_run:
+            with transaction.atomic():
+                UserProfile.objects.bulk_update(changed, ['preferred_category'])
+            # bulk_update sends no post_save, sessions still hold the old category
+            invalidate_profile_flags([profile.user_id for profile in changed])
+        return len(changed)
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+        workers = kwargs['workers']
+        model_name = kwargs['model']
+        dry_run = kwargs['dry_run']
+
+        def features(chunk):
+            return [encode_profile(age, gender, employment, income) for _, age, gender, employment, income, _, _ in chunk]
+
+        started = time.perf_counter()
+        total = changed = 0
+
+        if workers > 0:
+            # workers only predict, reading and writing stay in this process
+            with ProcessPoolExecutor(workers, initializer=_load_worker_model,
+                                     initargs=(registry.get_path(model_name),)) as pool:
+                pending = deque()
+                for chunk in self.iter_chunks(chunk_size):
+                    pending.append((chunk, pool.submit(_predict_chunk, features(chunk))))
+                    # bounded read-ahead so a huge table never queues up in memory
+                    while len(pending) > workers * 2:
+                        done_chunk, future = pending.popleft()
+                        changed += self.write_chunk(done_chunk, future.result(), dry_run)
+                        total += len(done_chunk)
+                while pending:
+                    done_chunk, future = pending.popleft()
+                    changed += self.write_chunk(done_chunk, future.result(), dry_run)
+                    total += len(done_chunk)
+        else:
+            for chunk in self.iter_chunks(chunk_size):
+                predictions = registry.predict(model_name, features(chunk))
+                changed += self.write_chunk(chunk, predictions, dry_run)
+                total += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        action = 'would change' if dry_run else 'changed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-scored {total} profiles in {elapsed:.1f}s ({rate:.0f} rows/sec), {action} {changed}.'
+        ))
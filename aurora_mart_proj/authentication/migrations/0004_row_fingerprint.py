@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_alter_userprofile_preferred_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='row_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+    ]
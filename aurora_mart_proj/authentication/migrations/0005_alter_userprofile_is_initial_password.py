@@ -0,0 +1,19 @@
+# The model's default changed to False before row_fingerprint was added, without a migration.
+# Only the Django-side default changes, existing rows keep their value.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_row_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='is_initial_password',
+            field=models.BooleanField(default=False),
+        ),
+    ]
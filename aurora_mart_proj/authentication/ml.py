@@ -0,0 +1,210 @@
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from joblib import load
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PREFERRED_CATEGORY_MODEL = 'preferred_category'
+FALLBACK_CATEGORY = 'General'
+# seconds between mtime checks of a loaded model file
+DEFAULT_RELOAD_CHECK_INTERVAL = 5
+# micro-batching of online predictions, see BatchingPredictor
+DEFAULT_BATCH_MAX_SIZE = 64
+DEFAULT_BATCH_MAX_WAIT = 0.005
+DEFAULT_PREDICT_TIMEOUT = 1.0
+
+# same encoding the customer model was trained with
+GENDER_CODES = {'Male': 0, 'Female': 1}
+OTHER_GENDER_CODE = 2
+EMPLOYMENT_STATUS_CODES = {
+    'Full-time': 1,
+    'Part-time': 1,
+    'Self-employed': 1,
+    'Unemployed': 0,
+    'Student': 1,
+    'Retired': 0,
+    'Others': 0
+}
+
+
+def encode_profile(age, gender, employment_status, monthly_income_sgd):
+    # feature vector for the preferred category model: [age, gender, employment, income]
+    return [
+        age,
+        GENDER_CODES.get(gender, OTHER_GENDER_CODE),
+        EMPLOYMENT_STATUS_CODES.get(employment_status, 0),
+        float(monthly_income_sgd),
+    ]
+
+
+def profile_features(profile):
+    return encode_profile(profile.age, profile.gender, profile.employment_status, profile.monthly_income_sgd)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LoadedModel:
+    def __init__(self, model, mtime, digest):
+        self.model = model
+        self.mtime = mtime
+        self.digest = digest
+        self.checked_at = time.monotonic()
+
+
+class ModelRegistry:
+    """Process-wide cache of the joblib models named in settings.ML_MODELS.
+
+    Each model is unpickled once per worker. The file's mtime is re-checked at most every
+    ML_MODEL_RELOAD_CHECK_INTERVAL seconds and the model is reloaded when its content hash changes.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, name):
+        try:
+            return os.fspath(settings.ML_MODELS[name])
+        except (AttributeError, KeyError):
+            raise KeyError(f'No model named {name!r} in settings.ML_MODELS')
+
+    def get(self, name):
+        loaded = self._models.get(name)
+        interval = getattr(settings, 'ML_MODEL_RELOAD_CHECK_INTERVAL', DEFAULT_RELOAD_CHECK_INTERVAL)
+        if loaded is not None and time.monotonic() - loaded.checked_at < interval:
+            return loaded.model
+
+        with self._lock:
+            loaded = self._models.get(name)
+            path = self.get_path(name)
+            mtime = os.stat(path).st_mtime_ns
+            if loaded is not None and loaded.mtime == mtime:
+                loaded.checked_at = time.monotonic()
+                return loaded.model
+
+            # new or touched file, only unpickle again if the bytes really changed
+            digest = file_digest(path)
+            if loaded is not None and loaded.digest == digest:
+                loaded.mtime = mtime
+                loaded.checked_at = time.monotonic()
+                return loaded.model
+
+            logger.info("Loading model %s from %s", name, path)
+            self._models[name] = LoadedModel(load(path), mtime, digest)
+            return self._models[name].model
+
+    def warm(self, names=None):
+        for name in names or getattr(settings, 'ML_MODELS', {}):
+            try:
+                self.get(name)
+            except FileNotFoundError:
+                # not fatal, callers fall back until the file is deployed
+                logger.info("Model %s not found, it will be loaded on first use", name)
+            except Exception:
+                logger.exception("Could not warm model %s", name)
+
+    def predict(self, name, rows):
+        # rows are plain feature vectors, e.g. from encode_profile
+        return list(self.get(name).predict(np.asarray(rows, dtype=float)))
+
+    def predict_one(self, name, row):
+        return self.predict(name, [row])[0]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+registry = ModelRegistry()
+
+
+class BatchingPredictor:
+    """Collects concurrent single-row predictions and runs them as one batched predict.
+
+    A background thread waits for the first queued row, then keeps gathering rows for up to
+    ML_BATCH_MAX_WAIT seconds or ML_BATCH_MAX_SIZE rows, whichever comes first, and hands
+    every caller its own result.
+    """
+
+    def __init__(self, model_name, registry=registry):
+        self.model_name = model_name
+        self.registry = registry
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # started lazily, and again in a forked worker process that did not inherit the thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f'batch-predict-{self.model_name}', daemon=True)
+                self._thread.start()
+
+    def predict(self, row, timeout=None):
+        """Prediction for one feature vector, raises TimeoutError when no batch answered in time."""
+        if timeout is None:
+            timeout = getattr(settings, 'ML_PREDICT_TIMEOUT', DEFAULT_PREDICT_TIMEOUT)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((row, future))
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            # still queued: cancelling makes the worker skip it
+            future.cancel()
+            raise
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            max_size = getattr(settings, 'ML_BATCH_MAX_SIZE', DEFAULT_BATCH_MAX_SIZE)
+            deadline = time.monotonic() + getattr(settings, 'ML_BATCH_MAX_WAIT', DEFAULT_BATCH_MAX_WAIT)
+            while len(batch) < max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # callers that already gave up are skipped
+            batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                predictions = self.registry.predict(self.model_name, [row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), prediction in zip(batch, predictions):
+                    future.set_result(prediction)
+
+
+_predictors = {}
+
+
+def get_batching_predictor(model_name=PREFERRED_CATEGORY_MODEL):
+    if model_name not in _predictors:
+        _predictors.setdefault(model_name, BatchingPredictor(model_name))
+    return _predictors[model_name]
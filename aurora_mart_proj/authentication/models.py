@@ -12,4 +12,5 @@ class UserProfile(models.Model):
     has_children = models.BooleanField(default=False)
     monthly_income_sgd = models.DecimalField(max_digits=20, decimal_places=11) # no restrictions on the decimal places due to the formatting type of the data inputs
     preferred_category = models.CharField(max_length=200, blank=True, null=True)
-    is_initial_password = models.BooleanField(default=False) # for setting of initial password
\ No newline at end of file
+    is_initial_password = models.BooleanField(default=False) # for setting of initial password
+    row_fingerprint = models.CharField(max_length=32, blank=True, default='', editable=False) # hash of the imported CSV row, empty for profiles made through onboarding
\ No newline at end of file
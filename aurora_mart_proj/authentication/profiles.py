@@ -0,0 +1,53 @@
+import uuid
+
+from django.core.cache import cache
+
+from .models import UserProfile
+
+PROFILE_FLAGS_SESSION_KEY = '_profile_flags'
+
+
+def get_profile(user):
+    # no query when request.user was loaded by ProfileBackend, a missing profile is cached as well
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.userprofile
+    except UserProfile.DoesNotExist:
+        return None
+
+
+def _version_key(user_id):
+    return f'profile-flags-version:{user_id}'
+
+
+def get_profile_flags(request):
+    """The small profile facts the auth flow routes on, kept in the session.
+
+    They are reloaded whenever the user's profile was saved since (see invalidate_profile_flags),
+    which needs a cache shared by all workers to be noticed in all of them.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    version = cache.get(_version_key(user.pk), '')
+    flags = request.session.get(PROFILE_FLAGS_SESSION_KEY)
+    if flags and flags['user_id'] == user.pk and flags['version'] == version:
+        return flags
+
+    profile = get_profile(user)
+    flags = {
+        'user_id': user.pk,
+        'version': version,
+        'has_profile': profile is not None,
+        'is_initial_password': profile.is_initial_password if profile else False,
+        'preferred_category': profile.preferred_category if profile else None,
+    }
+    request.session[PROFILE_FLAGS_SESSION_KEY] = flags
+    return flags
+
+
+def invalidate_profile_flags(user_ids):
+    # every session of these users reloads its flags on the next request, in every worker that
+    # shares this cache. With the per-process LocMemCache only this worker notices
+    cache.set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=None)
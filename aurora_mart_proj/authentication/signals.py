@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import UserProfile
+from .profiles import invalidate_profile_flags
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_profile_flags([instance.user_id])
+
+
+@contextmanager
+def profile_signals_disconnected():
+    # bulk deletes invalidate their users' flags in one call instead of once per profile.
+    # Disconnects for the whole process, so only for commands
+    post_delete.disconnect(profile_changed, sender=UserProfile)
+    try:
+        yield
+    finally:
+        post_delete.connect(profile_changed, sender=UserProfile)
@@ -1,3 +1,348 @@
-from django.test import TestCase
+from io import StringIO
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import joblib
+from openpyxl import Workbook
+from sklearn.dummy import DummyClassifier
+
+from aurora_mart_proj.metrics import registry as metrics_registry
+
+from .ml import PREFERRED_CATEGORY_MODEL, BatchingPredictor, encode_profile, registry
+from .models import UserProfile
+from .profiles import PROFILE_FLAGS_SESSION_KEY, get_profile_flags
+
+
+def train_constant_model(path, category):
+    model = DummyClassifier(strategy='constant', constant=category)
+    model.fit([[30, 0, 1, 5000.0], [40, 1, 0, 3000.0]], [category, category])
+    joblib.dump(model, path)
+
+
+class ModelTestMixin:
+    # a throwaway model file per test, picked up through settings.ML_MODELS
+
+    def setUp(self):
+        super().setUp()
+        self.model_dir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.model_dir.name, 'model.joblib')
+        train_constant_model(self.model_path, 'Electronics')
+        overrides = self.settings(ML_MODELS={PREFERRED_CATEGORY_MODEL: self.model_path}, ML_MODEL_RELOAD_CHECK_INTERVAL=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(self.model_dir.cleanup)
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+
+class ModelRegistryTests(ModelTestMixin, TestCase):
+
+    def test_model_is_loaded_once_and_reloaded_when_the_file_changes(self):
+        row = encode_profile(30, 'Female', 'Student', '4200.50')
+        self.assertEqual(row, [30, 1, 1, 4200.5])
+
+        model = registry.get(PREFERRED_CATEGORY_MODEL)
+        self.assertEqual(registry.predict_one(PREFERRED_CATEGORY_MODEL, row), 'Electronics')
+        self.assertIs(registry.get(PREFERRED_CATEGORY_MODEL), model)
+
+        # touching the file without changing it keeps the loaded model
+        os.utime(self.model_path, ns=(1, 1))
+        self.assertIs(registry.get(PREFERRED_CATEGORY_MODEL), model)
+
+        train_constant_model(self.model_path, 'Books')
+        self.assertEqual(registry.predict(PREFERRED_CATEGORY_MODEL, [row, row]), ['Books', 'Books'])
+
+
+class OnboardingTests(ModelTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('shopper', password='a-long-password-123')
+        self.client.force_login(self.user)
+
+    def onboard(self):
+        return self.client.post(reverse('onboarding'), {
+            'user': self.user.pk, 'age': 30, 'gender': 'Female', 'employment_status': 'Student', 'occupation': 'Student',
+            'education': 'Bachelor', 'household_size': 2, 'monthly_income_sgd': '4200.50',
+        })
+
+    def test_onboarding_predicts_the_preferred_category(self):
+        self.assertRedirects(self.onboard(), reverse('storefront_home'), fetch_redirect_response=False)
+        self.assertEqual(UserProfile.objects.get(user=self.user).preferred_category, 'Electronics')
+
+    def test_prediction_time_is_reported(self):
+        metrics_registry.clear()
+        self.onboard()
+        self.assertIn('http_request_phase_seconds_count{phase="ml",view="onboarding"} 1', metrics_registry.render())
+
+    def test_missing_model_falls_back_to_general(self):
+        os.remove(self.model_path)
+        with self.assertLogs('authentication.views', 'ERROR'):
+            self.onboard()
+        self.assertEqual(UserProfile.objects.get(user=self.user).preferred_category, 'General')
+
+
+class RescoreProfilesTests(ModelTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(7):
+            user = User.objects.create_user(f'customer{i}')
+            UserProfile.objects.create(
+                user=user, age=20 + i, gender='Male', employment_status='Full-time', occupation='Engineer',
+                education='Bachelor', household_size=1, monthly_income_sgd=3000 + i,
+                preferred_category='Books' if i % 2 else 'Electronics',
+            )
+
+    def test_rescore_in_chunks(self):
+        for workers in (0, 2):
+            with self.subTest(workers=workers):
+                UserProfile.objects.update(preferred_category='Books')
+                out = StringIO()
+                call_command('rescore_profiles', chunk_size=3, workers=workers, stdout=out)
+                self.assertIn('Re-scored 7 profiles', out.getvalue())
+                self.assertIn('changed 7', out.getvalue())
+                self.assertEqual(set(UserProfile.objects.values_list('preferred_category', flat=True)), {'Electronics'})
+
+    def test_dry_run_writes_nothing(self):
+        call_command('rescore_profiles', dry_run=True, stdout=StringIO())
+        self.assertEqual(UserProfile.objects.filter(preferred_category='Books').count(), 3)
+
+
+class BatchingPredictorTests(TestCase):
+
+    class SlowRegistry:
+        # records every batch it is asked to predict
+        def __init__(self, delay=0):
+            self.batches = []
+            self.delay = delay
+
+        def predict(self, name, rows):
+            time.sleep(self.delay)
+            self.batches.append(len(rows))
+            return [f'category-{row[0]}' for row in rows]
+
+    def test_concurrent_requests_share_one_predict(self):
+        fake = self.SlowRegistry()
+        predictor = BatchingPredictor('test', registry=fake)
+        barrier = threading.Barrier(10)
+        results = {}
+
+        def onboard(i):
+            barrier.wait()
+            results[i] = predictor.predict([i, 0, 1, 1000.0])
+
+        with self.settings(ML_BATCH_MAX_WAIT=0.2, ML_BATCH_MAX_SIZE=10):
+            threads = [threading.Thread(target=onboard, args=(i,)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, {i: f'category-{i}' for i in range(10)})
+        self.assertLess(len(fake.batches), 10)
+        self.assertEqual(sum(fake.batches), 10)
+
+    def test_timeout_raises_for_the_caller_to_fall_back(self):
+        predictor = BatchingPredictor('test', registry=self.SlowRegistry(delay=0.3))
+        with self.settings(ML_BATCH_MAX_WAIT=0):
+            with self.assertRaises(TimeoutError):
+                predictor.predict([1, 0, 1, 1000.0], timeout=0.05)
+
+
+# hashing cost is not what these tests are about
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersTests(TestCase):
+
+    def write_workbook(self, rows):
+        workbook = Workbook()
+        workbook.active.append(['Username ', 'Email', 'Password'])
+        for row in rows:
+            workbook.active.append(row)
+        f = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        workbook.save(f.name)
+        return f.name
+
+    def test_import_hashes_in_workers_and_skips_existing(self):
+        User.objects.create_user('user3', email='keep@example.com', password='old-password')
+        path = self.write_workbook([[f'user{i}', f'user{i}@example.com', f'secret-{i}'] for i in range(10)])
+
+        out = StringIO()
+        call_command('import_users', path, chunk_size=3, workers=2, stdout=out)
+        self.assertIn('9 created, 1 existing skipped', out.getvalue())
+        self.assertEqual(User.objects.count(), 10)
+        self.assertTrue(User.objects.get(username='user7').check_password('secret-7'))
+        self.assertTrue(User.objects.get(username='user3').check_password('old-password'))
+
+    def test_update_overwrites_existing_users(self):
+        User.objects.create_user('user1', email='old@example.com', password='old-password')
+        path = self.write_workbook([['user1', 'new@example.com', 1234], ['user2', None, 'pw']])
+
+        call_command('import_users', path, workers=0, existing='update', stdout=StringIO())
+        user = User.objects.get(username='user1')
+        self.assertEqual(user.email, 'new@example.com')
+        self.assertTrue(user.check_password('1234'))
+        self.assertFalse(user.is_staff)
+        self.assertEqual(User.objects.get(username='user2').email, '')
+
+
+class ImportProfilesTests(TestCase):
+    HEADER = 'username,age,gender,employment_status,occupation,education,household_size,has_children,monthly_income_sgd,preferred_category\n'
+
+    def write_csv(self, rows):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False)
+        self.addCleanup(os.remove, f.name)
+        with f:
+            f.write(self.HEADER + ''.join(rows))
+        return f.name
+
+    def row(self, username, has_children='False', age=30):
+        return f'{username},{age},Female,Student,Student,Bachelor,2,{has_children},4200.50,Books\n'
+
+    def test_rows_join_users_by_username_in_bounded_queries(self):
+        User.objects.bulk_create([User(username=f'user{i}') for i in range(20)])
+        # the file order has nothing to do with the user ids any more
+        rows = [self.row(f'user{i}', has_children='True' if i % 2 else 'False') for i in reversed(range(20))]
+        path = self.write_csv(rows + [self.row('nobody')])
+
+        err = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_profiles', path, chunk_size=10, stdout=StringIO(), stderr=err)
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        # per chunk: users, existing profiles, one insert. The last chunk only looks up the unknown user
+        self.assertEqual(len(statements), 3 + 3 + 1)
+        self.assertIn('nobody', err.getvalue())
+        self.assertEqual(UserProfile.objects.count(), 20)
+        self.assertFalse(UserProfile.objects.get(user__username='user4').has_children)
+        self.assertTrue(UserProfile.objects.get(user__username='user5').has_children)
+
+    def test_existing_profiles_are_skipped_or_updated(self):
+        User.objects.bulk_create([User(username='a'), User(username='b')])
+        call_command('import_profiles', self.write_csv([self.row('a')]), stdout=StringIO())
+
+        path = self.write_csv([self.row('a', age=41), self.row('b', age=52)])
+        out = StringIO()
+        call_command('import_profiles', path, stdout=out)
+        self.assertIn('1 created, 0 updated, 0 unchanged, 1 skipped', out.getvalue())
+        self.assertEqual(UserProfile.objects.get(user__username='a').age, 30)
+
+        call_command('import_profiles', path, update=True, stdout=StringIO())
+        self.assertEqual(UserProfile.objects.get(user__username='a').age, 41)
+
+    def test_delta_import_only_touches_changed_rows(self):
+        User.objects.bulk_create([User(username=f'user{i}') for i in range(5)])
+        onboarded = User.objects.create(username='onboarded')
+        UserProfile.objects.create(
+            user=onboarded, age=22, gender='Male', employment_status='Student', occupation='Student',
+            education='Bachelor', household_size=1, monthly_income_sgd=0,
+        )
+        rows = [self.row(f'user{i}') for i in range(5)]
+        call_command('import_profiles', self.write_csv(rows), stdout=StringIO())
+
+        # user1 changed, user4 left the feed, and 4200.5 is the same income as 4200.50
+        rows[1] = self.row('user1', age=31)
+        rows[2] = rows[2].replace('4200.50', '4200.5')
+        user4 = User.objects.get(username='user4').pk
+        cache.delete(f'profile-flags-version:{user4}')
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_profiles', self.write_csv(rows[:4]), update=True, delete_missing=True, stdout=out)
+        self.assertIn('0 created, 1 updated, 3 unchanged, 0 skipped, 1 deleted', out.getvalue())
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('31', updates[0])
+
+        self.assertEqual(UserProfile.objects.get(user__username='user1').age, 31)
+        self.assertFalse(UserProfile.objects.filter(user__username='user4').exists())
+        # deleted without the per-profile signal, the flags are still invalidated
+        self.assertIsNotNone(cache.get(f'profile-flags-version:{user4}'))
+        self.assertTrue(post_delete.has_listeners(UserProfile))
+        # profiles made through onboarding are never part of the feed
+        self.assertTrue(UserProfile.objects.filter(user=onboarded).exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AuthFlowQueryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='a-long-password-123')
+        self.profile = UserProfile.objects.create(
+            user=self.user, age=30, gender='Female', employment_status='Student', occupation='Student',
+            education='Bachelor', household_size=2, monthly_income_sgd='4200.50', preferred_category='Books',
+            is_initial_password=True,
+        )
+
+    def app_queries(self, queries):
+        # session storage is the session engine's business, not part of the auth flow budget
+        return [
+            q['sql'] for q in queries
+            if 'django_session' not in q['sql'] and 'SAVEPOINT' not in q['sql']
+        ]
+
+    def test_login_routes_on_one_profile_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'a-long-password-123'})
+        self.assertRedirects(response, reverse('change_password'), fetch_redirect_response=False)
+        # the user, its last_login update and the profile flags
+        self.assertEqual(len(self.app_queries(queries)), 3)
+        self.assertTrue(self.client.session[PROFILE_FLAGS_SESSION_KEY]['is_initial_password'])
+
+    def test_sessions_of_the_plain_model_backend_stay_logged_in(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('onboarding'))
+        self.assertEqual(response.context['user'], self.user)
+        self.assertTrue(response.context['user'].is_authenticated)
+
+    def test_wrong_password_is_hashed_once(self):
+        with mock.patch.object(User, 'check_password', autospec=True, return_value=False) as check_password:
+            self.assertFalse(self.client.login(username='shopper', password='wrong'))
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_user_and_profile_are_loaded_in_one_query(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('onboarding'))
+        self.assertEqual(response.context['form'].instance, self.profile)
+        profile_queries = [sql for sql in self.app_queries(queries) if 'authentication_userprofile' in sql]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertIn('JOIN "authentication_userprofile"', profile_queries[0])
+
+    def test_change_password_clears_initial_flag(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('change_password'), {'old_password': 'x', 'new_password': 'another-password-456'})
+        # user with profile, password update, is_initial_password update
+        self.assertEqual(len(self.app_queries(queries)), 3)
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.is_initial_password)
+
+    def test_session_flags_are_reloaded_after_a_profile_save(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.user = User.objects.select_related('userprofile').get(pk=self.user.pk)
+        self.assertEqual(get_profile_flags(request)['preferred_category'], 'Books')
+        with self.assertNumQueries(0):
+            get_profile_flags(request)
+
+        UserProfile.objects.filter(pk=self.profile.pk).update(preferred_category='Electronics')
+        request.user = User.objects.select_related('userprofile').get(pk=self.user.pk)
+        # no save signal, the session keeps serving the cached flags
+        self.assertEqual(get_profile_flags(request)['preferred_category'], 'Books')
+
+        self.profile.preferred_category = 'Electronics'
+        self.profile.save()
+        self.assertEqual(get_profile_flags(request)['preferred_category'], 'Electronics')
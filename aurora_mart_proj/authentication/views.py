@@ -5,12 +5,11 @@ from django.contrib import messages
 from django.contrib.auth import login, update_session_auth_hash
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.conf import settings
-from .models import UserProfile
 from .forms import RegistrationForm, onboardingForm, ChangePasswordForm
 from django.urls import reverse_lazy
-import os
-from joblib import load
-import pandas as pd
+from .ml import FALLBACK_CATEGORY, PREFERRED_CATEGORY_MODEL, get_batching_predictor, profile_features
+from .profiles import get_profile, get_profile_flags
+from aurora_mart_proj.metrics import timed
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,14 +26,14 @@ class customLoginView(LoginView):
 
     def get_success_url(self):
         user = self.request.user
-        try:
-            user_profile =  UserProfile.objects.get(user=user)
-            if user_profile.is_initial_password:
-                return reverse_lazy("change_password") # dynamically builds the url and returns the string URL lazily 
-        
-        except UserProfile.DoesNotExist:
+        # one profile query here, later requests read these flags from the session
+        flags = get_profile_flags(self.request)
+        if not flags['has_profile']:
             # create the user to redirect to onboarding
             return reverse_lazy("onboarding")
+
+        if flags['is_initial_password']:
+            return reverse_lazy("change_password") # dynamically builds the url and returns the string URL lazily 
         
         if user.is_staff:
             return reverse_lazy("admin_dashboard") # for admins - yet to create
@@ -62,44 +61,27 @@ class OnboardingView(LoginRequiredMixin, FormView):
     # modify the FormView form instantiation process to ensure that the onboarding form uses the specific instance (which contains the UserProfile if previously inputted)
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        user = self.request.user
-        try:
-            # might lead to a not null constraint we were to force feed into the instance attribute
-            user_profile = UserProfile.objects.get(user=user)
+        # might lead to a not null constraint we were to force feed into the instance attribute
+        # request.user already carries its profile (authentication.backends.ProfileBackend), no extra query
+        user_profile = get_profile(self.request.user)
+        if user_profile is not None:
             kwargs['instance'] = user_profile
-        except UserProfile.DoesNotExist:
-            pass
         return kwargs
     
     # validate all the fields in the form and generate preferred category using ai model
     def form_valid(self, form):
-        form.save(commit=True, user=self.request.user)
-        profile = UserProfile.objects.get(user=self.request.user)
+        # predicted before saving, so the profile is written once
+        profile = form.save(commit=False, user=self.request.user)
 
         try:
-            model_path = os.path.join(settings.BASE_DIR, 'models', 'b2c_customers_100.joblib')
-            model = load(model_path)
-            gender_code = 0 if profile.gender == 'Male' else 1 if profile.gender == 'Female' else 2
-            employment_status_code = {
-                'Full-time': 1,
-                'Part-time': 1,
-                'Self-employed': 1,
-                'Unemployed': 0,
-                'Student': 1,
-                'Retired': 0,
-                'Others': 0
-            }.get(profile.employment_status, 0)
-            input_df = pd.DataFrame([
-                [profile.age, gender_code, employment_status_code, profile.monthly_income_sgd]
-            ])
-            predicted_category = model.predict(input_df)[0]
-            profile.preferred_category = predicted_category
-            profile.save()
+            # batched with the other onboardings in flight, times out into the fallback below
+            with timed('ml'):
+                profile.preferred_category = get_batching_predictor(PREFERRED_CATEGORY_MODEL).predict(profile_features(profile))
         except Exception as e:
-            logger.error(f"ML prediction failed for user {profile.user.username}: {str(e)}")
+            logger.error(f"ML prediction failed for user {self.request.user.username}: {e!r}")
             # create a fall back for the category
-            profile.preferred_category = "General"
-            profile.save()
+            profile.preferred_category = FALLBACK_CATEGORY
+        profile.save()
         return super().form_valid(form)
     
 class ChangePasswordView(LoginRequiredMixin, FormView):
@@ -117,10 +99,10 @@ class ChangePasswordView(LoginRequiredMixin, FormView):
         # save the new password
         self.request.user.set_password(form.cleaned_data['new_password'])
         self.request.user.save()
-        profile = UserProfile.objects.get(user=self.request.user)
-        if profile.is_initial_password:
+        profile = get_profile(self.request.user)
+        if profile is not None and profile.is_initial_password:
             profile.is_initial_password = False
-            profile.save()
+            profile.save(update_fields=['is_initial_password'])
         # update the user's session data, prevents the user from getting logged out immediately after the pw update
         update_session_auth_hash(self.request, self.request.user)
         # check if the user is a staff, redirect to the admin page
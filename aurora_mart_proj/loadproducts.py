@@ -1,19 +1,5 @@
-import csv
-from storefront.models import Product
+from django.core.management import call_command
 
 def run():
-    with open('data/b2c_products_500.csv', newline='', encoding='cp1252') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            Product.objects.create(
-                sku_code=row['SKU code'],
-                product_name=row['Product name'],
-                product_description=row['Product description'],
-                product_category=row['Product Category'],
-                product_subcategory=row['Product Subcategory'],
-                quantity_on_hand=int(row['Quantity on hand']),
-                reorder_quantity=int(row['Reorder Quantity']),
-                unit_price=float(row['Unit price']),
-                product_rating=float(row['Product rating'])
-            )
-    print("Products loaded successfully!")
+    # kept for `manage.py shell` habits, the work is done by the load_products command
+    call_command('load_products', 'data/b2c_products_500.csv', encoding='cp1252')
@@ -0,0 +1,141 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .associations import DEFAULT_TOP_K, related_products
+from .cart import CartOperationError, apply_cart_operations, build_cart_lines
+from .models import Product
+from .pagination import get_sort, order_by_sort
+from .suggest import MAX_SUGGESTIONS, suggest
+from .views import filter_products
+
+# what partner feeds may project (and get by default), listed on purpose: a new column on Product
+# (row_fingerprint, reorder_quantity) stays internal until it is added here
+PRODUCT_FIELDS = [
+    'sku_code', 'product_name', 'product_description', 'product_category', 'product_subcategory',
+    'quantity_on_hand', 'unit_price', 'product_rating',
+]
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def stream_json_array(rows, encoder):
+    # one row at a time, nothing but the current database chunk is ever held in memory
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + encoder.encode(row)
+        first = False
+    yield ']'
+
+
+@require_GET
+def product_feed(request):
+    query = request.GET.get('query', '')
+    sort = get_sort(request.GET.get('sort'), query)
+
+    fields = [field for field in request.GET.get('fields', '').split(',') if field] or PRODUCT_FIELDS
+    unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown:
+        return JsonResponse({'error': f"Unknown fields: {', '.join(unknown)}", 'fields': PRODUCT_FIELDS}, status=400)
+
+    products = filter_products(Product.objects.all(), request.GET.get('category'), query)
+    products = order_by_sort(products, sort).values(*fields)
+
+    limit = request.GET.get('limit')
+    if limit:
+        try:
+            products = products[:max(int(limit), 0)]
+        except ValueError:
+            return JsonResponse({'error': 'limit must be an integer.'}, status=400)
+
+    chunk_size = getattr(settings, 'STOREFRONT_API_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    rows = products.iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(
+        stream_json_array(rows, DjangoJSONEncoder()),
+        content_type='application/json',
+    )
+
+
+@require_GET
+def search_suggestions(request):
+    # answered from the in-process prefix index, no database round trip once it is built
+    try:
+        limit = int(request.GET.get('limit', MAX_SUGGESTIONS))
+    except ValueError:
+        limit = MAX_SUGGESTIONS
+    suggestions = suggest(request.GET.get('q', ''), limit)
+    storefront_url = reverse('storefront_home')
+    for suggestion in suggestions:
+        if suggestion['type'] == 'product':
+            suggestion['url'] = reverse('product_detail', args=[suggestion['value']])
+        elif suggestion['type'] == 'category':
+            suggestion['url'] = f"{storefront_url}?{urlencode({'category': suggestion['value']})}"
+        else:
+            suggestion['url'] = f"{storefront_url}?{urlencode({'query': suggestion['value']})}"
+    return JsonResponse({'suggestions': suggestions})
+
+
+@require_http_methods(['GET', 'POST'])
+def cart_api(request):
+    # POST {"operations": [{"sku_code": ..., "delta": n} | {"sku_code": ..., "quantity": n}, ...]}
+    cart = request.session.get('cart', {})
+    errors = []
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body or b'{}')
+            cart = apply_cart_operations(cart, payload.get('operations', []) if isinstance(payload, dict) else None)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Request body must be JSON.'}, status=400)
+        except CartOperationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    # the same query that prices the lines tells us which SKUs do not exist
+    cart_items, subtotal = build_cart_lines(cart)
+    if len(cart_items) != len(cart):
+        known = {item['product'].sku_code for item in cart_items}
+        errors = [f'Unknown product {sku}.' for sku in cart if sku not in known]
+        cart = {sku: quantity for sku, quantity in cart.items() if sku in known}
+
+    if request.method == 'POST' or errors:
+        request.session['cart'] = cart
+
+    return JsonResponse({
+        'lines': [
+            {
+                'sku_code': item['product'].sku_code,
+                'product_name': item['product'].product_name,
+                'unit_price': item['product'].unit_price,
+                'quantity': item['quantity'],
+                'total_price': item['total_price'],
+            }
+            for item in cart_items
+        ],
+        'item_count': sum(cart.values()),
+        'subtotal': subtotal,
+        # For now, total is the same as subtotal
+        'total': subtotal,
+        'errors': errors,
+    })
+
+
+@require_GET
+def frequently_bought_together(request, sku_code):
+    # reads the precomputed association table only, rules are mined offline
+    related = related_products([sku_code], DEFAULT_TOP_K)
+    return JsonResponse({
+        'sku_code': sku_code,
+        'products': [
+            {
+                'sku_code': product.sku_code,
+                'product_name': product.product_name,
+                'unit_price': product.unit_price,
+                'url': reverse('product_detail', args=[product.sku_code]),
+            }
+            for product in related
+        ],
+    })
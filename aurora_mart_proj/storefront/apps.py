@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StorefrontConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'storefront'
+
+    def ready(self):
+        # keeps the search index and the catalog version in step with Product saves/deletes
+        from . import signals  # noqa: F401
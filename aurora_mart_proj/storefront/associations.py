@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .cache import bump_catalog_version
+from .models import Product, ProductAssociation, StockReservation
+
+DEFAULT_TOP_K = 5
+
+
+def reservation_baskets():
+    # the checkout holds currently in the database, one basket per reservation reference.
+    # Confirmed and released holds are deleted, so this is only a recent sample of carts,
+    # the order history export (mine_associations --csv) is what the rules should come from
+    baskets = defaultdict(set)
+    rows = StockReservation.objects.order_by().values_list('reference', 'product_id')
+    for reference, sku in rows.iterator(chunk_size=5000):
+        baskets[reference].add(sku)
+    return list(baskets.values())
+
+
+def mine_rules(baskets, min_support=0.01, min_confidence=0.1):
+    """FP-Growth over the baskets, returns {sku: [(related_sku, confidence, lift), ...]} best first.
+
+    Only rules with a single antecedent are kept, which is what a per-SKU lookup can answer.
+    """
+    # imported here so the request path never loads pandas/mlxtend
+    import numpy as np
+    import pandas as pd
+    from mlxtend.frequent_patterns import association_rules, fpgrowth
+    from mlxtend.preprocessing import TransactionEncoder
+
+    baskets = [sorted(basket) for basket in baskets if len(basket) > 1]
+    if not baskets:
+        return {}
+
+    encoder = TransactionEncoder()
+    onehot = encoder.fit(baskets).transform(baskets, sparse=True)
+    frame = pd.DataFrame.sparse.from_spmatrix(onehot, columns=encoder.columns_)
+    itemsets = fpgrowth(frame, min_support=min_support, use_colnames=True, max_len=2)
+    if itemsets.empty:
+        return {}
+    # mlxtend divides by zero for some of the extra metrics it computes, those are not used here
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rules = association_rules(itemsets, num_itemsets=len(baskets), metric='confidence', min_threshold=min_confidence)
+
+    related = defaultdict(dict)
+    for antecedents, consequents, confidence, lift in zip(
+        rules['antecedents'], rules['consequents'], rules['confidence'], rules['lift']
+    ):
+        if len(antecedents) != 1 or len(consequents) != 1:
+            continue
+        (sku,), (other,) = antecedents, consequents
+        best = related[sku].get(other)
+        if best is None or (confidence, lift) > best:
+            related[sku][other] = (float(confidence), float(lift))
+
+    return {
+        sku: sorted(((other, c, l) for other, (c, l) in others.items()), key=lambda rule: (-rule[1], -rule[2], rule[0]))
+        for sku, others in related.items()
+    }
+
+
+def drop_unknown_skus(rules):
+    """``rules`` without the SKUs that are not in the catalog, and how many SKUs that dropped.
+
+    Order history names products that were discontinued since, their rows would fail the
+    foreign keys of ProductAssociation.
+    """
+    skus = set(rules)
+    for ranked in rules.values():
+        skus.update(other for other, _, _ in ranked)
+    known = set(Product.objects.filter(sku_code__in=skus).values_list('sku_code', flat=True))
+    kept = {}
+    for sku, ranked in rules.items():
+        if sku not in known:
+            continue
+        ranked = [rule for rule in ranked if rule[0] in known]
+        if ranked:
+            kept[sku] = ranked
+    return kept, len(skus - known)
+
+
+def store_rules(rules, top_k=DEFAULT_TOP_K):
+    """Replace the stored associations with the top ``top_k`` of ``rules``, returns (stored, dropped SKUs)."""
+    # swap the whole lookup table in one transaction, readers see either the old or the new rules.
+    # Nothing left to store (too few baskets, thresholds too high) keeps the old rules rather than wiping them
+    rules, dropped = drop_unknown_skus(rules) if rules else ({}, 0)
+    if not rules:
+        return 0, dropped
+    associations = [
+        ProductAssociation(product_id=sku, related_id=other, rank=rank, confidence=confidence, lift=lift)
+        for sku, ranked in rules.items()
+        for rank, (other, confidence, lift) in enumerate(ranked[:top_k])
+    ]
+    with transaction.atomic():
+        ProductAssociation.objects.all().delete()
+        ProductAssociation.objects.bulk_create(associations, batch_size=1000)
+    # cached product details embed these, let them be rebuilt
+    bump_catalog_version()
+    return len(associations), dropped
+
+
+def related_products(sku_codes, limit=DEFAULT_TOP_K):
+    """Top related products for one or more SKUs, an indexed lookup with no mining involved."""
+    sku_codes = list(sku_codes)
+    return top_related(related_queryset(sku_codes, limit), limit)
+
+
+async def arelated_products(sku_codes, limit=DEFAULT_TOP_K):
+    sku_codes = list(sku_codes)
+    return top_related([association async for association in related_queryset(sku_codes, limit)], limit)
+
+
+def related_queryset(sku_codes, limit):
+    associations = (
+        ProductAssociation.objects.filter(product_id__in=sku_codes)
+        .exclude(related_id__in=sku_codes)
+        .select_related('related')
+        .only('related__sku_code', 'related__product_name', 'related__unit_price', 'rank', 'confidence')
+        .order_by('rank', '-confidence')
+    )
+    return associations[:limit * max(len(sku_codes), 1)]
+
+
+def top_related(associations, limit):
+    results = []
+    seen = set()
+    for association in associations:
+        if association.related_id in seen:
+            continue
+        seen.add(association.related_id)
+        results.append(association.related)
+        if len(results) == limit:
+            break
+    return results
@@ -0,0 +1,123 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_POST
+
+from .associations import arelated_products
+from .cache import aget_catalog_version, aget_stock_version, catalog_cache_key
+from .cart import abuild_cart_lines, add_item, remove_item, set_item_quantity
+from .facets import aget_category_facets
+from .models import Product
+from .pagination import akeyset_page, get_sort
+from .views import (
+    GRID_CACHE_TIMEOUT, LISTING_FIELDS, cart_etag, filter_products, render_cart, render_product_grid,
+    render_storefront, storefront_etag,
+)
+
+# Native async versions of the page and cart views, routed instead of the ones in views.py when
+# settings.STOREFRONT_ASYNC_VIEWS is on (off by default, meant for asgi.py). Database and cache access is
+# awaited, so a request waiting on either does not tie up the thread the sync views would need.
+
+
+def acondition(etag_func):
+    # django's condition() calls etag_func synchronously, these await the session and cache first
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = await etag_func(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if etag and request.method in ('GET', 'HEAD'):
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+async def storefront_aetag(request):
+    # loads the session once, messages and the sync ETag helper then read the loaded copy
+    await request.session.aget('cart')
+    return storefront_etag(request, await aget_catalog_version(), await aget_stock_version())
+
+
+async def cart_aetag(request):
+    await request.session.aget('cart')
+    return cart_etag(request, await aget_catalog_version())
+
+
+async def aget_product_grid(active_category, query, sort, after, version):
+    stock_version = await aget_stock_version()
+    key = catalog_cache_key('grid', active_category or 'All', query, sort, after, stock_version, version=version)
+    product_grid = await cache.aget(key)
+    if product_grid is not None:
+        return mark_safe(product_grid)
+
+    products = Product.objects.only(*LISTING_FIELDS)
+    if query:
+        # the FTS5 lookup is a raw cursor query, which has no async API
+        products = await sync_to_async(filter_products)(products, active_category, query)
+    else:
+        products = filter_products(products, active_category, query)
+    products, next_cursor = await akeyset_page(products, sort, after)
+
+    product_grid = render_product_grid(products, next_cursor, active_category, query, sort, after)
+    await cache.aset(key, str(product_grid), getattr(settings, 'STOREFRONT_GRID_CACHE_TIMEOUT', GRID_CACHE_TIMEOUT))
+    return product_grid
+
+
+@acondition(storefront_aetag)
+async def storefront(request):
+    query = request.GET.get('query', '')
+    sort = get_sort(request.GET.get('sort'), query)
+    # every cached piece of the page is keyed on the same catalog version, fetch it once
+    version = await aget_catalog_version()
+    categories = await aget_category_facets(version)
+    cart = await request.session.aget('cart', {})
+    product_grid = await aget_product_grid(
+        request.GET.get('category'), query, sort, request.GET.get('after', ''), version,
+    )
+    return render_storefront(request, categories, product_grid, cart)
+
+
+@acondition(cart_aetag)
+async def view_cart(request):
+    cart = await request.session.aget('cart', {})
+    cart_items, subtotal = await abuild_cart_lines(cart)
+    recommendations = await arelated_products(cart.keys()) if cart else []
+    return render_cart(request, cart_items, subtotal, recommendations)
+
+
+async def add_to_cart(request):
+    if request.method == "POST":
+        sku = request.POST.get("sku_code")
+        cart = await request.session.aget("cart", {})
+        await request.session.aset("cart", add_item(cart, sku))
+
+        messages.success(request, "Item added to cart!")
+        return redirect(request.META.get("HTTP_REFERER", "storefront_home"))
+
+
+@require_POST
+async def update_cart(request):
+    sku = request.POST.get('sku_code')
+    quantity = int(request.POST.get('quantity', 1))
+    cart = await request.session.aget('cart', {})
+    await request.session.aset('cart', set_item_quantity(cart, sku, quantity))
+    return redirect('view_cart')
+
+
+@require_POST
+async def remove_from_cart(request):
+    sku = request.POST.get('sku_code')
+    cart = await request.session.aget('cart', {})
+    await request.session.aset('cart', remove_item(cart, sku))
+    return redirect('view_cart')
@@ -0,0 +1,90 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+# every cached piece of catalog data is keyed on this number, bumping it orphans the
+# old entries at once (they simply age out) instead of deleting keys one by one
+CATALOG_VERSION_KEY = 'storefront:catalog-version'
+# when the version was last bumped, used for Last-Modified headers
+CATALOG_MODIFIED_KEY = 'storefront:catalog-modified'
+# quantity_on_hand moves with every checkout. Only what shows it (the grid, product details and
+# their ETags) is keyed on this as well, facets and suggestions keep living off the catalog version
+STOCK_VERSION_KEY = 'storefront:stock-version'
+STOCK_MODIFIED_KEY = 'storefront:stock-modified'
+
+
+def _initial_version():
+    # start from the clock rather than 1, so a version key lost to eviction or a
+    # restart can never come back as a number that older entries were stored under
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key, _initial_version())
+    return version
+
+
+async def _aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key, _initial_version())
+    return version
+
+
+def _bump_version(key, modified_key):
+    cache.set(modified_key, timezone.now(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # key missing, anything newer than what was there before will do
+        version = _initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+async def aget_catalog_version():
+    return await _aget_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump_version(CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY)
+
+
+def get_stock_version():
+    return _get_version(STOCK_VERSION_KEY)
+
+
+async def aget_stock_version():
+    return await _aget_version(STOCK_VERSION_KEY)
+
+
+def bump_stock_version():
+    return _bump_version(STOCK_VERSION_KEY, STOCK_MODIFIED_KEY)
+
+
+def get_stock_last_modified():
+    # the later of the last catalog and stock changes, for pages that show quantity_on_hand.
+    # None until the first write this cache has seen, callers then skip Last-Modified
+    modified = [value for value in cache.get_many([CATALOG_MODIFIED_KEY, STOCK_MODIFIED_KEY]).values() if value]
+    return max(modified, default=None)
+
+
+def catalog_cache_key(name, *parts, version=None):
+    if version is None:
+        version = get_catalog_version()
+    key = f'storefront:{name}:v{version}'
+    if parts:
+        # request parameters can hold anything, hashing keeps the key short and memcached-safe
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        key = f'{key}:{digest}'
+    return key
@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+from .models import Product
+
+# columns the cart page and the cart API show for each line
+CART_FIELDS = ['sku_code', 'product_name', 'product_category', 'unit_price']
+MAX_CART_OPERATIONS = 100
+
+
+class CartOperationError(ValueError):
+    pass
+
+
+def build_cart_lines(cart):
+    """Return (cart_items, subtotal) for a session cart with one sku_code__in query."""
+    # Get product objects for SKUs in cart
+    products_in_cart = Product.objects.filter(sku_code__in=cart.keys()).only(*CART_FIELDS)
+    return price_cart_lines(products_in_cart, cart)
+
+
+async def abuild_cart_lines(cart):
+    products_in_cart = Product.objects.filter(sku_code__in=list(cart.keys())).only(*CART_FIELDS)
+    return price_cart_lines([product async for product in products_in_cart.aiterator()], cart)
+
+
+def price_cart_lines(products_in_cart, cart):
+    cart_items = []
+    subtotal = Decimal('0.00')
+
+    for product in products_in_cart:
+        quantity = cart[product.sku_code]
+        total_item_price = product.unit_price * quantity
+
+        cart_items.append({
+            'product': product,
+            'quantity': quantity,
+            'total_price': total_item_price
+        })
+        subtotal += total_item_price
+    return cart_items, subtotal
+
+
+# the form views' cart edits, shared by the sync and async views
+
+def add_item(cart, sku):
+    cart[sku] = cart.get(sku, 0) + 1
+    return cart
+
+
+def set_item_quantity(cart, sku, quantity):
+    if sku in cart:
+        if quantity > 0:
+            # Optional: Check stock levels again
+            # product = Product.objects.get(sku_code=sku)
+            # if quantity > product.quantity_on_hand: ...
+            cart[sku] = quantity
+        else:
+            # Remove if quantity is 0 or less
+            del cart[sku]
+    return cart
+
+
+def remove_item(cart, sku):
+    cart.pop(sku, None)
+    return cart
+
+
+def apply_cart_operations(cart, operations):
+    # each operation is {"sku_code", "delta"} or {"sku_code", "quantity"}, a line at 0 or less is removed
+    if not isinstance(operations, list):
+        raise CartOperationError('operations must be a list.')
+    if len(operations) > MAX_CART_OPERATIONS:
+        raise CartOperationError(f'At most {MAX_CART_OPERATIONS} operations per request.')
+
+    cart = dict(cart)
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get('sku_code'), str):
+            raise CartOperationError('Every operation needs a sku_code.')
+        sku = operation['sku_code']
+        try:
+            if 'quantity' in operation:
+                quantity = int(operation['quantity'])
+            else:
+                quantity = cart.get(sku, 0) + int(operation.get('delta', 1))
+        except (TypeError, ValueError, OverflowError):
+            # OverflowError is int(inf), e.g. a delta of 1e400 in the JSON
+            raise CartOperationError(f'Invalid quantity for {sku}.')
+
+        if quantity > 0:
+            cart[sku] = quantity
+        else:
+            cart.pop(sku, None)
+    return cart
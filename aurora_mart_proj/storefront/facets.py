@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .cache import aget_catalog_version, catalog_cache_key
+from .models import Product
+
+DEFAULT_FACET_TIMEOUT = 60 * 60
+
+
+def get_category_facets():
+    """[{'name', 'count', 'subcategories': [{'name', 'count'}]}] per category, cached per catalog version."""
+    key = catalog_cache_key('facets')
+    facets = cache.get(key)
+    if facets is None:
+        facets = build_category_facets()
+        cache.set(key, facets, getattr(settings, 'STOREFRONT_FACET_TIMEOUT', DEFAULT_FACET_TIMEOUT))
+    return facets
+
+
+async def aget_category_facets(version=None):
+    if version is None:
+        version = await aget_catalog_version()
+    key = catalog_cache_key('facets', version=version)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = group_facets([row async for row in facet_rows()])
+        await cache.aset(key, facets, getattr(settings, 'STOREFRONT_FACET_TIMEOUT', DEFAULT_FACET_TIMEOUT))
+    return facets
+
+
+def facet_rows():
+    # a single GROUP BY gives both levels, the category counts are the sums of their subcategories
+    return (
+        Product.objects.order_by()
+        .values('product_category', 'product_subcategory')
+        .annotate(count=Count('sku_code'))
+        .order_by('product_category', 'product_subcategory')
+    )
+
+
+def group_facets(rows):
+    facets = []
+    for row in rows:
+        if not facets or facets[-1]['name'] != row['product_category']:
+            facets.append({'name': row['product_category'], 'count': 0, 'subcategories': []})
+        facets[-1]['count'] += row['count']
+        facets[-1]['subcategories'].append({'name': row['product_subcategory'], 'count': row['count']})
+    return facets
+
+
+def build_category_facets():
+    return group_facets(facet_rows())
+
+
+def get_total_count(facets):
+    return sum(facet['count'] for facet in facets)
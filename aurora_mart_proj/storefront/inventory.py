@@ -0,0 +1,110 @@
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .cache import bump_stock_version
+from .models import Product, StockReservation
+
+DEFAULT_RESERVATION_TTL = timedelta(minutes=15)
+# SQLite reports a busy writer as an OperationalError, those transactions are simply retried
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+
+class InsufficientStock(Exception):
+    def __init__(self, sku_code):
+        self.sku_code = sku_code
+        super().__init__(f'Not enough stock for {sku_code}.')
+
+
+def get_reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_RESERVATION_TTL)
+
+
+def _retry_on_lock(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(LOCK_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                    raise
+                time.sleep(LOCK_RETRY_DELAY * (attempt + 1))
+    return wrapper
+
+
+@_retry_on_lock
+def reserve_stock(lines, reference=None, ttl=None):
+    """Take ``{sku_code: quantity}`` out of stock and hold it under ``reference``.
+
+    All or nothing: if any line is short, InsufficientStock is raised and no stock moves.
+    """
+    reference = reference or uuid.uuid4().hex
+    expires_at = timezone.now() + (ttl or get_reservation_ttl())
+    lines = {sku: int(quantity) for sku, quantity in lines.items() if int(quantity) > 0}
+
+    with transaction.atomic():
+        # the check and the decrement are one conditional UPDATE, so concurrent
+        # reservations can never both see the same units. Sorted to keep lock order stable
+        for sku, quantity in sorted(lines.items()):
+            updated = Product.objects.filter(sku_code=sku, quantity_on_hand__gte=quantity).update(
+                quantity_on_hand=F('quantity_on_hand') - quantity
+            )
+            if not updated:
+                raise InsufficientStock(sku)
+
+        StockReservation.objects.bulk_create([
+            StockReservation(reference=reference, product_id=sku, quantity=quantity, expires_at=expires_at)
+            for sku, quantity in lines.items()
+        ])
+        # grids, product details and their ETags show quantity_on_hand, the stock version renews
+        # just those (queryset updates send no post_save, the catalog version stays as it is)
+        transaction.on_commit(bump_stock_version)
+    return reference
+
+
+def _give_back(reservations):
+    # claim the rows first: only the transaction whose UPDATE marks them returns their stock
+    token = uuid.uuid4().hex
+    claimed = reservations.filter(release_token__isnull=True).update(release_token=token)
+    if not claimed:
+        return 0
+
+    claimed_rows = StockReservation.objects.filter(release_token=token)
+    totals = dict(
+        claimed_rows.order_by().values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    # one UPDATE for every product involved
+    Product.objects.filter(sku_code__in=totals).update(
+        quantity_on_hand=F('quantity_on_hand') + Case(*[When(sku_code=sku, then=total) for sku, total in totals.items()])
+    )
+    claimed_rows.delete()
+    transaction.on_commit(bump_stock_version)
+    return claimed
+
+
+@_retry_on_lock
+def release_reservation(reference):
+    # the cart was abandoned or changed, put its stock back
+    with transaction.atomic():
+        return _give_back(StockReservation.objects.filter(reference=reference))
+
+
+@_retry_on_lock
+def release_expired_reservations(now=None):
+    with transaction.atomic():
+        return _give_back(StockReservation.objects.filter(expires_at__lte=now or timezone.now()))
+
+
+@_retry_on_lock
+def confirm_reservation(reference):
+    # the order went through, the stock stays decremented and the hold is dropped
+    with transaction.atomic():
+        return StockReservation.objects.filter(reference=reference, release_token__isnull=True).delete()[0]
@@ -0,0 +1,305 @@
+"""Endpoint load benchmark: synthetic catalogs and shoppers, driven through the test client.
+
+generate_dataset() tops the database up to N synthetic products, users and profiles,
+run_endpoints() requests every storefront, cart and auth endpoint in turn and returns
+latency percentiles and the most SQL queries any one request needed, and find_regressions()
+compares that with a stored baseline. benchmark_endpoints is the command around it.
+
+Onboarding runs a real prediction: the configured model, or a small fixture model trained
+on synthetic profiles when that file is not deployed (prediction_model()).
+"""
+import math
+import os
+import random
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from authentication.ml import FALLBACK_CATEGORY, PREFERRED_CATEGORY_MODEL, encode_profile, registry
+from authentication.models import UserProfile
+
+from .cache import bump_catalog_version
+from .models import Product
+from .pagination import SEARCH_SORT, SORT_OPTIONS
+from .search import get_search_backend
+
+SKU_PREFIX = 'SYN-'
+USERNAME_PREFIX = 'synth'
+ONBOARDING_PREFIX = 'synth-onboarding-'
+PASSWORD = 'synthetic-password-123'
+BATCH_SIZE = 5000
+# every tenth synthetic user has no profile yet, like a customer who never finished onboarding
+NO_PROFILE_EVERY = 10
+
+CATEGORIES = {
+    'Electronics': ['Audio', 'Cameras', 'Laptops', 'Phones'],
+    'Books': ['Fiction', 'Non-fiction', 'Comics'],
+    'Home & Kitchen': ['Cookware', 'Furniture', 'Lighting'],
+    'Sports': ['Cycling', 'Fitness', 'Outdoor'],
+    'Beauty': ['Fragrance', 'Skincare'],
+}
+ADJECTIVES = ['compact', 'classic', 'deluxe', 'portable', 'smart', 'wireless', 'organic', 'premium']
+NOUNS = ['speaker', 'lamp', 'novel', 'kettle', 'bottle', 'camera', 'jacket', 'serum', 'headphones', 'chair']
+# search terms, all of them appear in synthetic product names
+SEARCH_TERMS = ['wireless', 'lamp', 'premium camera', 'kettle', 'smart speaker']
+
+PROFILE = {
+    'age': 34, 'gender': 'Female', 'employment_status': 'Full-time', 'occupation': 'Engineer',
+    'education': 'Bachelor', 'household_size': 3, 'has_children': True, 'monthly_income_sgd': Decimal('5200.00'),
+}
+
+
+class EndpointError(Exception):
+    pass
+
+
+def train_fixture_model(path, samples=2000):
+    """A small decision tree over synthetic profiles, saved with joblib like the real model."""
+    # imported here so the storefront never loads sklearn unless a benchmark runs
+    import joblib
+    from sklearn.tree import DecisionTreeClassifier
+
+    rng = random.Random(0)
+    categories = list(CATEGORIES)
+    rows = []
+    labels = []
+    for _ in range(samples):
+        row = encode_profile(
+            rng.randrange(18, 75), rng.choice(['Male', 'Female', 'Other']),
+            rng.choice(['Full-time', 'Student', 'Retired', 'Unemployed']), rng.randrange(0, 15_000),
+        )
+        rows.append(row)
+        labels.append(categories[(row[0] // 10 + row[1] + int(row[3]) // 3000) % len(categories)])
+    joblib.dump(DecisionTreeClassifier(max_depth=8, random_state=0).fit(rows, labels), path)
+
+
+@contextmanager
+def prediction_model():
+    """Yields the path of the model onboarding predicts with, a fixture one if none is deployed."""
+    path = registry.get_path(PREFERRED_CATEGORY_MODEL)
+    if os.path.exists(path):
+        yield path
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fixture_model.joblib')
+        train_fixture_model(path)
+        registry.clear()
+        try:
+            with override_settings(ML_MODELS={**settings.ML_MODELS, PREFERRED_CATEGORY_MODEL: path}):
+                yield path
+        finally:
+            registry.clear()
+
+
+def synthetic_product(i):
+    # seeded per row so a catalog topped up later has the same rows as one generated at once
+    rng = random.Random(i)
+    category = list(CATEGORIES)[i % len(CATEGORIES)]
+    return Product(
+        sku_code=f'{SKU_PREFIX}{i:07d}',
+        product_name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS)} {i}',
+        product_description=f'A {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} for everyday use.',
+        product_category=category,
+        product_subcategory=rng.choice(CATEGORIES[category]),
+        # plenty of stock so checkout never runs out mid benchmark
+        quantity_on_hand=10_000,
+        reorder_quantity=50,
+        unit_price=Decimal(rng.randrange(199, 99_999)) / 100,
+        product_rating=round(rng.uniform(1, 5), 1),
+    )
+
+
+def generate_dataset(size, stdout=None):
+    """Make the synthetic part of the database exactly ``size`` products and ``size`` users."""
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    # zero padded keys compare like numbers, so anything past the requested size is one range
+    Product.objects.filter(sku_code__startswith=SKU_PREFIX, sku_code__gte=f'{SKU_PREFIX}{size:07d}').delete()
+    User.objects.filter(username__startswith=USERNAME_PREFIX, username__gte=f'{USERNAME_PREFIX}{size:07d}').delete()
+
+    have = Product.objects.filter(sku_code__startswith=SKU_PREFIX).count()
+    if have < size:
+        log(f'Generating {size - have} products')
+    for start in range(have, size, BATCH_SIZE):
+        with transaction.atomic():
+            Product.objects.bulk_create([synthetic_product(i) for i in range(start, min(start + BATCH_SIZE, size))])
+
+    have = User.objects.filter(username__startswith=USERNAME_PREFIX).exclude(username__startswith=ONBOARDING_PREFIX).count()
+    if have < size:
+        log(f'Generating {size - have} users')
+    # one real hash shared by every synthetic user, hashing a million passwords is not the point
+    password = make_password(PASSWORD)
+    for start in range(have, size, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, size)
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=f'{USERNAME_PREFIX}{i:07d}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+                for i in range(start, stop)
+            ])
+            users = User.objects.filter(
+                username__gte=f'{USERNAME_PREFIX}{start:07d}', username__lt=f'{USERNAME_PREFIX}{stop:07d}',
+            ).values_list('pk', 'username')
+            UserProfile.objects.bulk_create([
+                UserProfile(user_id=pk, preferred_category=list(CATEGORIES)[pk % len(CATEGORIES)], **PROFILE)
+                for pk, username in users
+                if int(username[len(USERNAME_PREFIX):]) % NO_PROFILE_EVERY
+            ])
+
+    # bulk_create skips the signals that keep the search index and the caches current
+    get_search_backend().rebuild()
+    bump_catalog_version()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(len(sorted_values) * pct / 100) - 1)]
+
+
+class Shopper:
+    """The clients and rows one iteration of the endpoints needs."""
+
+    def __init__(self, size):
+        self.size = size
+        self.browser = Client()
+        self.cart = Client()
+        self.customer = Client()
+        self.onboarding = []
+        self.password = make_password(PASSWORD)
+
+    def sku(self, i):
+        return f'{SKU_PREFIX}{(i * 7919) % self.size:07d}'
+
+    def login_username(self, i):
+        # a user with a profile, so login routes straight to the storefront
+        n = (i * 7919) % self.size
+        if n % NO_PROFILE_EVERY == 0:
+            n = (n + 1) % self.size
+        return f'{USERNAME_PREFIX}{n:07d}'
+
+    def prepare_onboarding(self, i):
+        # a fresh user per iteration, logged in outside the timed request
+        user = User.objects.create(username=f'{ONBOARDING_PREFIX}{i}', password=self.password)
+        self.onboarding.append(user.pk)
+        self.customer = Client()
+        self.customer.force_login(user)
+        return user
+
+    def predicted_category(self):
+        return UserProfile.objects.filter(user_id=self.onboarding[-1]).values_list('preferred_category', flat=True).first()
+
+    def cleanup(self):
+        User.objects.filter(pk__in=self.onboarding).delete()
+
+
+def endpoint_scenarios():
+    """(name, request) pairs in the order one iteration runs them, request(shopper, i) returns a response."""
+    categories = list(CATEGORIES)
+    scenarios = [
+        ('storefront', lambda s, i: s.browser.get(reverse('storefront_home'))),
+        ('storefront_category', lambda s, i: s.browser.get(
+            reverse('storefront_home'), {'category': categories[i % len(categories)]},
+        )),
+    ]
+    for sort in SORT_OPTIONS:
+        if sort == SEARCH_SORT:
+            continue
+        scenarios.append((f'sort_{sort}', lambda s, i, sort=sort: s.browser.get(
+            reverse('storefront_home'), {'sort': sort, 'category': categories[i % len(categories)]},
+        )))
+    scenarios += [
+        ('search', lambda s, i: s.browser.get(reverse('storefront_home'), {'query': SEARCH_TERMS[i % len(SEARCH_TERMS)]})),
+        ('product_detail', lambda s, i: s.browser.get(reverse('product_detail', args=[s.sku(i)]))),
+        ('cart_add', lambda s, i: s.cart.post(reverse('add_to_cart'), {'sku_code': s.sku(i)})),
+        ('cart_view', lambda s, i: s.cart.get(reverse('view_cart'))),
+        ('cart_update', lambda s, i: s.cart.post(reverse('update_cart'), {'sku_code': s.sku(i), 'quantity': 2})),
+        ('checkout', lambda s, i: s.cart.post(reverse('checkout'))),
+        ('cart_remove', lambda s, i: s.cart.post(reverse('remove_from_cart'), {'sku_code': s.sku(i)})),
+        ('login', lambda s, i: Client().post(reverse('login'), {'username': s.login_username(i), 'password': PASSWORD})),
+        ('onboarding_form', lambda s, i: s.customer.get(reverse('onboarding'))),
+        ('onboarding', lambda s, i: s.customer.post(reverse('onboarding'), {**PROFILE, 'user': s.onboarding[-1]})),
+    ]
+    return scenarios
+
+
+def timed_request(request, shopper, i):
+    with ExitStack() as stack:
+        # every alias, catalog reads go to the replica
+        captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        started = time.perf_counter()
+        response = request(shopper, i)
+        elapsed = time.perf_counter() - started
+    return response, elapsed, sum(len(capture) for capture in captures)
+
+
+def run_endpoints(size, iterations, names=None):
+    """{endpoint: {'requests', 'p50_ms', 'p95_ms', 'p99_ms', 'queries'}} for a database generated at ``size``."""
+    scenarios = [(name, request) for name, request in endpoint_scenarios() if not names or name in names]
+    timings = {name: [] for name, _ in scenarios}
+    queries = {name: 0 for name, _ in scenarios}
+    shopper = Shopper(size)
+    onboarding = any(name.startswith('onboarding') for name, _ in scenarios)
+    # every request of a benchmark is measured here, the slow request log would only be noise
+    with prediction_model(), override_settings(METRICS_SLOW_REQUEST_THRESHOLD=math.inf):
+        try:
+            for i in range(iterations):
+                if onboarding:
+                    shopper.prepare_onboarding(i)
+                for name, request in scenarios:
+                    if name.startswith('sort_'):
+                        # the default sort is also what the category tab cached, a cold cache makes
+                        # every sort budget cover its own ordered query
+                        cache.clear()
+                    response, elapsed, count = timed_request(request, shopper, i)
+                    if response.status_code >= 400:
+                        raise EndpointError(f'{name} answered {response.status_code}')
+                    if name == 'onboarding' and shopper.predicted_category() == FALLBACK_CATEGORY:
+                        raise EndpointError(f'onboarding fell back to {FALLBACK_CATEGORY}, the prediction failed')
+                    timings[name].append(elapsed)
+                    # the budget is the worst request, cold caches included
+                    queries[name] = max(queries[name], count)
+        finally:
+            shopper.cleanup()
+
+    results = {}
+    for name, values in timings.items():
+        values.sort()
+        results[name] = {
+            'requests': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'queries': queries[name],
+        }
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.5, slack_ms=5.0):
+    """Human readable regressions of ``results`` against one size of the baseline.
+
+    More queries than the budget always fails, latency only once p95 exceeds the baseline
+    by ``tolerance`` (a fraction) plus ``slack_ms``, timings are noisy.
+    """
+    regressions = []
+    for name, result in results.items():
+        budget = baseline.get(name)
+        if budget is None:
+            continue
+        if result['queries'] > budget['queries']:
+            regressions.append(f"{name}: {result['queries']} queries, budget {budget['queries']}")
+        limit = budget['p95_ms'] * (1 + tolerance) + slack_ms
+        if result['p95_ms'] > limit:
+            regressions.append(f"{name}: p95 {result['p95_ms']:.1f}ms, baseline {budget['p95_ms']:.1f}ms")
+    return regressions
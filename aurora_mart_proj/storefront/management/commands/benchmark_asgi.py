@@ -0,0 +1,91 @@
+import asyncio
+import statistics
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.urls import include, path, reverse
+
+from storefront import async_views, views
+from storefront.models import Product
+from storefront.urls import storefront_urlpatterns
+
+SORTS = ['name-asc', 'price-asc', 'rating-desc']
+
+
+class ViewUrls:
+    # the storefront routed to one set of page views, whatever STOREFRONT_ASYNC_VIEWS says
+    def __init__(self, page_views):
+        self.urlpatterns = [path('storefront/', include(storefront_urlpatterns(page_views)))]
+
+
+class Command(BaseCommand):
+    # writes real sessions to the configured database, run it against a dev copy
+    help = (
+        "Drive the storefront and cart views through Django's ASGI handler with many concurrent "
+        "shoppers on one event loop, once with the sync views and once with async_views."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=32, help="Shoppers in flight at once.")
+        parser.add_argument('--rounds', type=int, default=10, help="Browse/add/cart/update rounds per shopper.")
+        parser.add_argument(
+            '--mode', choices=['sync', 'async'],
+            help="Only benchmark these views. By default the sync ones run first, then async_views.",
+        )
+
+    async def shopper(self, number, skus, categories, rounds, latencies):
+        client = AsyncClient()
+
+        async def timed(method, *args, **kwargs):
+            started = time.perf_counter()
+            response = await method(*args, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise CommandError(f'{response.status_code} from {args[0]}')
+
+        for i in range(rounds):
+            sku = skus[(number + i) % len(skus)]
+            await timed(client.get, reverse('storefront_home'), {
+                'category': categories[(number + i) % len(categories)], 'sort': SORTS[i % len(SORTS)],
+            })
+            await timed(client.post, reverse('add_to_cart'), {'sku_code': sku})
+            await timed(client.get, reverse('view_cart'))
+            await timed(client.post, reverse('update_cart'), {'sku_code': sku, 'quantity': 2})
+        return client.cookies['sessionid'].value if 'sessionid' in client.cookies else None
+
+    async def run_shoppers(self, concurrency, rounds, skus, categories):
+        latencies = []
+        started = time.perf_counter()
+        session_keys = await asyncio.gather(*[
+            self.shopper(number, skus, categories, rounds, latencies) for number in range(concurrency)
+        ])
+        return time.perf_counter() - started, latencies, session_keys
+
+    def run_mode(self, mode, concurrency, rounds):
+        skus = list(Product.objects.values_list('sku_code', flat=True)[:50])
+        if not skus:
+            raise CommandError('No products to browse, load some first.')
+        categories = ['All'] + list(
+            Product.objects.order_by().values_list('product_category', flat=True).distinct()
+        )
+
+        page_views = async_views if mode == 'async' else views
+        with override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF=ViewUrls(page_views)):
+            elapsed, latencies, session_keys = asyncio.run(self.run_shoppers(concurrency, rounds, skus, categories))
+        Session.objects.filter(session_key__in=[key for key in session_keys if key]).delete()
+
+        latencies.sort()
+        self.stdout.write(
+            f'{mode:6} {len(latencies) / elapsed:8.0f} req/sec   '
+            f'p50 {statistics.median(latencies) * 1000:7.2f}ms   '
+            f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.2f}ms   '
+            f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.2f}ms'
+        )
+
+    def handle(self, *args, **kwargs):
+        concurrency, rounds = kwargs['concurrency'], kwargs['rounds']
+        self.stdout.write(f'{concurrency} concurrent shoppers x {rounds} rounds of 4 requests, one event loop')
+        for mode in [kwargs['mode']] if kwargs['mode'] else ['sync', 'async']:
+            self.run_mode(mode, concurrency, rounds)
@@ -0,0 +1,107 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from storefront.loadtest import EndpointError, endpoint_scenarios, find_regressions, generate_dataset, run_endpoints
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'perf_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every storefront, cart and auth endpoint against synthetic catalogs of the given sizes "
+        "in the test database. Fails when an endpoint needs more queries than its budget in the baseline "
+        "file or its p95 latency regressed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, action='append', dest='sizes',
+            help="Synthetic products and users, repeatable (500 up to 1000000). Default 500.",
+        )
+        parser.add_argument('--iterations', type=int, default=20, help="Requests per endpoint and size.")
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help="Only this endpoint, repeatable.")
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Budget file, default perf_baseline.json.")
+        parser.add_argument('--update-baseline', action='store_true', help="Store this run as the new baseline.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed p95 slowdown as a fraction of the baseline (plus 5ms), default 0.5.",
+        )
+        parser.add_argument('--output', help="Also write the results of this run as JSON.")
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help="Keep the test database, so the next run only generates the rows it is missing.",
+        )
+
+    def read_baseline(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def handle(self, *args, **kwargs):
+        sizes = kwargs['sizes'] or [500]
+        known = {name for name, _ in endpoint_scenarios()}
+        unknown = set(kwargs['endpoints'] or []) - known
+        if unknown:
+            raise CommandError(f"Unknown endpoints {', '.join(sorted(unknown))}, choose from {', '.join(sorted(known))}")
+
+        # a throwaway database, the synthetic rows never mix with real ones
+        verbosity = kwargs['verbosity']
+        setup_test_environment()
+        old_config = setup_databases(verbosity, interactive=False, keepdb=kwargs['keepdb'])
+        try:
+            results = {}
+            for size in sorted(sizes):
+                generate_dataset(size, self.stdout)
+                cache.clear()
+                try:
+                    results[str(size)] = run_endpoints(size, kwargs['iterations'], kwargs['endpoints'])
+                except EndpointError as e:
+                    raise CommandError(str(e))
+                self.report(size, results[str(size)])
+        finally:
+            teardown_databases(old_config, verbosity, keepdb=kwargs['keepdb'])
+            teardown_test_environment()
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        baseline = self.read_baseline(kwargs['baseline'])
+        if kwargs['update_baseline']:
+            for size, endpoints in results.items():
+                baseline.setdefault(size, {}).update({
+                    name: {'queries': result['queries'], 'p95_ms': result['p95_ms']}
+                    for name, result in endpoints.items()
+                })
+            with open(kwargs['baseline'], 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(f"Baseline written to {kwargs['baseline']}")
+            return
+
+        regressions = []
+        for size, endpoints in results.items():
+            if size not in baseline:
+                self.stdout.write(f'No baseline for {size} rows, nothing to compare')
+                continue
+            regressions += [
+                f'{size} rows, {regression}'
+                for regression in find_regressions(endpoints, baseline[size], kwargs['tolerance'])
+            ]
+        if regressions:
+            raise CommandError('Regressed:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Every endpoint is within its budget.'))
+
+    def report(self, size, results):
+        self.stdout.write(f'{size} products / {size} users')
+        for name, result in results.items():
+            self.stdout.write(
+                f"  {name:20} {result['requests']:4} req   p50 {result['p50_ms']:8.2f}ms   "
+                f"p95 {result['p95_ms']:8.2f}ms   p99 {result['p99_ms']:8.2f}ms   {result['queries']:3} queries"
+            )
@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from storefront.models import Product
+from storefront.sessions import writer
+
+DEFAULT_ENGINES = [
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'storefront.sessions',
+]
+
+
+class Command(BaseCommand):
+    # writes real sessions to the configured database, run it against a dev copy
+    help = "Compare cart operation throughput across session engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', action='append', dest='engines', help="Session engine module, repeatable.")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent shoppers.")
+        parser.add_argument('--ops', type=int, default=200, help="Cart operations per shopper.")
+
+    def shopper(self, skus, ops, latencies, session_keys, lock):
+        client = Client()
+        timings = []
+        try:
+            for i in range(ops):
+                sku = skus[i % len(skus)]
+                started = time.perf_counter()
+                if i % 3 == 2:
+                    client.post(reverse('update_cart'), {'sku_code': sku, 'quantity': 2})
+                else:
+                    client.post(reverse('add_to_cart'), {'sku_code': sku})
+                timings.append(time.perf_counter() - started)
+        finally:
+            with lock:
+                latencies.extend(timings)
+                session_keys.append(client.cookies['sessionid'].value if 'sessionid' in client.cookies else None)
+            connections.close_all()
+
+    def run_engine(self, engine, skus, threads, ops):
+        latencies = []
+        session_keys = []
+        lock = threading.Lock()
+        with override_settings(SESSION_ENGINE=engine, ALLOWED_HOSTS=['testserver']):
+            workers = [
+                threading.Thread(target=self.shopper, args=(skus, ops, latencies, session_keys, lock))
+                for _ in range(threads)
+            ]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            # write-behind is only done once its sessions are in the database
+            writer.flush()
+            elapsed = time.perf_counter() - started
+
+        Session.objects.filter(session_key__in=[key for key in session_keys if key]).delete()
+        latencies.sort()
+        return len(latencies) / elapsed, latencies
+
+    def handle(self, *args, **kwargs):
+        skus = list(Product.objects.values_list('sku_code', flat=True)[:20])
+        if not skus:
+            raise CommandError('No products to put in carts, load some first.')
+
+        threads, ops = kwargs['threads'], kwargs['ops']
+        self.stdout.write(f'{threads} shoppers x {ops} cart operations')
+        for engine in kwargs['engines'] or DEFAULT_ENGINES:
+            rate, latencies = self.run_engine(engine, skus, threads, ops)
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+            self.stdout.write(
+                f'{engine:45} {rate:8.0f} ops/sec   '
+                f'p50 {statistics.median(latencies) * 1000:6.2f}ms   p95 {p95 * 1000:6.2f}ms'
+            )
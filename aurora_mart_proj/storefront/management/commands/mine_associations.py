@@ -0,0 +1,58 @@
+from collections import defaultdict
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+
+from storefront.associations import DEFAULT_TOP_K, mine_rules, reservation_baskets, store_rules
+
+class Command(BaseCommand):
+    # offline job: the storefront only ever reads the table this writes
+    help = (
+        "Mine 'frequently bought together' rules with FP-Growth and store the top products per SKU. "
+        "Run it on the order history (--csv), the checkout reservations alone are only the carts "
+        "currently held. When nothing is mined the stored rules are left as they are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--csv', dest='csv_file',
+            help=(
+                "Order history export with order_id and sku_code columns, the real source of the rules. "
+                "Defaults to the checkout reservations still held."
+            ),
+        )
+        parser.add_argument('--min-support', type=float, default=0.01)
+        parser.add_argument('--min-confidence', type=float, default=0.1)
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+
+    def read_csv_baskets(self, path):
+        baskets = defaultdict(set)
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                baskets[row['order_id']].add(row['sku_code'])
+        return list(baskets.values())
+
+    def handle(self, *args, **kwargs):
+        started = time.perf_counter()
+        if kwargs['csv_file']:
+            baskets = self.read_csv_baskets(kwargs['csv_file'])
+        else:
+            baskets = reservation_baskets()
+
+        rules = mine_rules(baskets, kwargs['min_support'], kwargs['min_confidence'])
+        if not rules:
+            self.stdout.write(self.style.WARNING(
+                f'No rules found in {len(baskets)} baskets, keeping the stored associations.'
+            ))
+            return
+        stored, dropped = store_rules(rules, kwargs['top_k'])
+        if dropped:
+            self.stdout.write(self.style.WARNING(f'Dropped {dropped} SKUs that are no longer in the catalog.'))
+        if not stored:
+            self.stdout.write(self.style.WARNING('No rules left to store, keeping the stored associations.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Mined {len(baskets)} baskets in {time.perf_counter() - started:.1f}s, '
+            f'stored {stored} associations for {len(rules)} products.'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from storefront.inventory import release_expired_reservations
+
+class Command(BaseCommand):
+    # meant to run from cron every minute or so
+    help = "Return the stock held by expired checkout reservations."
+
+    def handle(self, *args, **kwargs):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
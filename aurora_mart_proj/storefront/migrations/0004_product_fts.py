@@ -0,0 +1,46 @@
+# Full-text search index for the storefront search box. Only created on SQLite builds
+# that ship FTS5, every other database keeps using the icontains search.
+
+from django.db import migrations
+
+FTS_TABLE = 'storefront_product_fts'
+COLUMNS = 'sku_code, product_name, product_category, product_subcategory, product_description'
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if not fts5_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "sku_code UNINDEXED, product_name, product_category, product_subcategory, product_description, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM storefront_product")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storefront', '0003_delete_cartitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
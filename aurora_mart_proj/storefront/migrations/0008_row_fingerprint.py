@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storefront', '0007_productassociation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='row_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Re-key the full-text index on the product table's rowid, so a product is found in the index
+# by rowid instead of a scan of the UNINDEXED sku_code column (see FTS5SearchBackend).
+
+from django.db import migrations
+
+FTS_TABLE = 'storefront_product_fts'
+COLUMNS = 'sku_code, product_name, product_category, product_subcategory, product_description'
+
+
+def rekey_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, {COLUMNS}) SELECT rowid, {COLUMNS} FROM storefront_product")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storefront', '0008_row_fingerprint'),
+    ]
+
+    operations = [
+        # the old keys still work for reading, nothing to undo
+        migrations.RunPython(rekey_fts_table, migrations.RunPython.noop),
+    ]
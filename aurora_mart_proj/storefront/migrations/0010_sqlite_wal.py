@@ -0,0 +1,33 @@
+# Switch the database file to write-ahead logging once. journal_mode=WAL is stored in the file
+# itself, so it does not belong in init_command where every connection would (re)write it.
+
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def disable_wal(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=DELETE')
+
+
+class Migration(migrations.Migration):
+    # the journal mode can't be changed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('storefront', '0009_product_fts_rowid'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -11,7 +11,44 @@ class Product(models.Model):
     reorder_quantity = models.IntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     product_rating = models.FloatField()
+    # hash of the feed row this product was last loaded from, lets load_products skip unchanged rows
+    row_fingerprint = models.CharField(max_length=32, blank=True, default='', editable=False)
 
     class Meta:
         ordering = ['product_category', 'product_name']
+        # one index per storefront sort, with and without the category tab filter.
+        # sku_code is the keyset tie-breaker, so it completes every index
+        indexes = [
+            models.Index(fields=['product_name', 'sku_code'], name='product_name_idx'),
+            models.Index(fields=['unit_price', 'sku_code'], name='product_price_idx'),
+            models.Index(fields=['product_rating', 'sku_code'], name='product_rating_idx'),
+            models.Index(fields=['product_category', 'product_name', 'sku_code'], name='product_cat_name_idx'),
+            models.Index(fields=['product_category', 'unit_price', 'sku_code'], name='product_cat_price_idx'),
+            models.Index(fields=['product_category', 'product_rating', 'sku_code'], name='product_cat_rating_idx'),
+        ]
 
+
+class StockReservation(models.Model):
+    # stock held for a cart at checkout, quantity_on_hand is already decremented by this amount
+    reference = models.CharField(max_length=64, db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # set while a release is giving the stock back, so two releasers never return it twice
+    release_token = models.CharField(max_length=32, null=True, blank=True, db_index=True)
+
+
+class ProductAssociation(models.Model):
+    # "frequently bought together", written offline by the mine_associations command
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='associations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    confidence = models.FloatField()
+    lift = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_association_rank'),
+        ]
@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# sort key -> (column, descending). sku_code is appended as the tie-breaker so every
+# position in the listing is unique and the next page can be found with a plain WHERE
+SORT_OPTIONS = {
+    'name-asc': ('product_name', False),
+    'name-desc': ('product_name', True),
+    'price-asc': ('unit_price', False),
+    'price-desc': ('unit_price', True),
+    'rating-asc': ('product_rating', False),
+    'rating-desc': ('product_rating', True),
+    # only offered for searches, search_rank is annotated by the search backend
+    'relevance': ('search_rank', False),
+}
+DEFAULT_SORT = 'name-asc'
+SEARCH_SORT = 'relevance'
+TIE_BREAKER = 'sku_code'
+
+DEFAULT_PAGE_SIZE = 24
+
+
+def get_page_size():
+    return getattr(settings, 'STOREFRONT_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def get_sort(sort, query=''):
+    # unknown sort values fall back to the default instead of an unordered listing
+    if not sort:
+        sort = SEARCH_SORT if query else DEFAULT_SORT
+    if sort not in SORT_OPTIONS or (sort == SEARCH_SORT and not query):
+        sort = DEFAULT_SORT
+    return sort
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # a tampered or stale cursor simply means "start from the first page"
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    # [sort value, sku_code], anything else was not made by encode_cursor
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], str):
+        return None
+    return values
+
+
+def _cursor_value(obj, field):
+    value = getattr(obj, field)
+    # Decimal is not JSON serialisable, str keeps the exact value
+    if not isinstance(value, (str, int, float)):
+        value = str(value)
+    return value
+
+
+def order_by_sort(queryset, sort):
+    field, descending = SORT_OPTIONS[sort]
+    prefix = '-' if descending else ''
+    return queryset.order_by(prefix + field, prefix + TIE_BREAKER)
+
+
+def keyset_queryset(queryset, sort, cursor=None, page_size=None):
+    """The query for the page that starts after ``cursor``, one row longer than the page."""
+    field, descending = SORT_OPTIONS[sort]
+    page_size = page_size or get_page_size()
+    queryset = order_by_sort(queryset, sort)
+
+    values = decode_cursor(cursor)
+    if values is not None:
+        last_value, last_sku = values
+        try:
+            if field in queryset.query.annotations:
+                model_field = queryset.query.annotations[field].output_field
+            else:
+                model_field = queryset.model._meta.get_field(field)
+            last_value = model_field.to_python(last_value)
+        except ValidationError:
+            last_value = None
+    if values is not None and last_value is not None:
+        op = 'lt' if descending else 'gt'
+        # the leading (field >= value) range lets the sort index seek straight to the
+        # cursor, the OR only breaks ties on the rows that share the last value
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}e': last_value}),
+            Q(**{f'{field}__{op}': last_value}) | Q(**{f'{TIE_BREAKER}__{op}': last_sku}),
+        )
+
+    # fetch one extra row to know whether there is a next page without a COUNT(*)
+    return queryset[:page_size + 1]
+
+
+def split_page(rows, sort, page_size=None):
+    """(rows, next_cursor) from the rows of keyset_queryset."""
+    field, _ = SORT_OPTIONS[sort]
+    page_size = page_size or get_page_size()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([_cursor_value(last, field), getattr(last, TIE_BREAKER)])
+    return rows, next_cursor
+
+
+def keyset_page(queryset, sort, cursor=None, page_size=None):
+    """Return (rows, next_cursor) for the page that starts after ``cursor``."""
+    rows = list(keyset_queryset(queryset, sort, cursor, page_size))
+    return split_page(rows, sort, page_size)
+
+
+async def akeyset_page(queryset, sort, cursor=None, page_size=None):
+    rows = [row async for row in keyset_queryset(queryset, sort, cursor, page_size)]
+    return split_page(rows, sort, page_size)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+# catalog reads are by far the most frequent queries and never need the latest write
+REPLICA_MODELS = {'storefront.product'}
+
+
+class CatalogReplicaRouter:
+    """Sends Product reads to the read-only 'replica' alias, everything else to 'default'.
+
+    Inside a transaction on 'default' reads stay there, so code that writes and then reads
+    products (imports, checkout) sees its own uncommitted changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in REPLICA_MODELS or REPLICA_ALIAS not in settings.DATABASES:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same data, a product read from the replica can be saved on default
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is the same database opened read-only, it is migrated through 'default'
+        if db == REPLICA_ALIAS:
+            return False
+        return None
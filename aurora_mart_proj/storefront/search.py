@@ -0,0 +1,159 @@
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'storefront_product_fts'
+# indexed columns, in the order they are declared in the virtual table
+FTS_COLUMNS = ['product_name', 'product_category', 'product_subcategory', 'product_description']
+# bm25 weights: sku_code (unindexed), then the columns above - a hit in the name counts the most
+FTS_WEIGHTS = (0.0, 10.0, 5.0, 3.0, 1.0)
+
+DEFAULT_BACKEND = 'storefront.search.FTS5SearchBackend'
+DEFAULT_MAX_RESULTS = 500
+
+# search terms are reduced to plain words so user input can never break the MATCH syntax
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class IcontainsSearchBackend:
+    # the original LIKE '%query%' search, used wherever full-text search is not available
+    def search(self, queryset, query):
+        queryset = queryset.filter(Q(product_name__icontains=query) | Q(product_category__icontains=query))
+        # name matches first, so the "relevance" sort is still meaningful
+        return queryset.annotate(search_rank=Case(
+            When(product_name__icontains=query, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        ))
+
+    def index_product(self, product, created=False):
+        pass
+
+    def remove_product(self, sku_code):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class FTS5SearchBackend(IcontainsSearchBackend):
+    # BM25-ranked search over an FTS5 virtual table that mirrors Product (SQLite only)
+    def __init__(self):
+        self.max_results = getattr(settings, 'STOREFRONT_SEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS)
+        self.fallback = IcontainsSearchBackend()
+        self._available = {}
+
+    def get_connection(self):
+        return connections[router.db_for_write(Product)]
+
+    def is_available(self, connection=None):
+        connection = connection or self.get_connection()
+        # looked up once per database alias, the table only appears or disappears through migrations
+        if connection.alias not in self._available:
+            available = False
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                    available = cursor.fetchone() is not None
+            self._available[connection.alias] = available
+        return self._available[connection.alias]
+
+    def build_match(self, query):
+        words = WORD_RE.findall(query)
+        # every word has to appear, the last one may still be being typed
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def ranked_skus(self, query, queryset=None):
+        match = self.build_match(query)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        connection = self.get_connection()
+        sql = f"SELECT sku_code FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        params = [match]
+        if queryset is not None and queryset.query.where:
+            # the category tab and any other filter go inside the ranked query, so max_results
+            # caps the matches the visitor can actually see rather than the whole catalog's
+            candidates, candidate_params = queryset.order_by().values('pk').query.get_compiler(
+                connection=connection,
+            ).as_sql()
+            sql += f" AND sku_code IN ({candidates})"
+            params += list(candidate_params)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{sql} ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s", params + [self.max_results])
+            return [row[0] for row in cursor.fetchall()]
+
+    def search(self, queryset, query):
+        try:
+            if not self.is_available():
+                return self.fallback.search(queryset, query)
+            skus = self.ranked_skus(query, queryset)
+        except DatabaseError:
+            logger.exception("Full-text search failed, falling back to icontains")
+            return self.fallback.search(queryset, query)
+
+        if not skus:
+            return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+        # rank = position in the bm25 ordering, so it can be used as a keyset sort column
+        return queryset.filter(sku_code__in=skus).annotate(search_rank=Case(
+            *[When(sku_code=sku, then=Value(position)) for position, sku in enumerate(skus)],
+            default=Value(len(skus)),
+            output_field=IntegerField(),
+        ))
+
+    # index rows share the product row's rowid, so keeping one product current is two rowid
+    # lookups instead of a scan of the whole index. A VACUUM may renumber the product rowids,
+    # run rebuild() after one
+    def index_product(self, product, created=False):
+        connection = self.get_connection()
+        if not self.is_available(connection):
+            return
+        with connection.cursor() as cursor:
+            if not created:
+                cursor.execute(self.delete_row_sql(), [product.sku_code])
+            cursor.execute(f"{self.copy_rows_sql()} WHERE sku_code = %s", [product.sku_code])
+
+    def remove_product(self, sku_code):
+        # called before the product row is deleted, its rowid is looked up through it
+        connection = self.get_connection()
+        if not self.is_available(connection):
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.delete_row_sql(), [sku_code])
+
+    def delete_row_sql(self):
+        return (
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = "
+            f"(SELECT rowid FROM {Product._meta.db_table} WHERE sku_code = %s)"
+        )
+
+    def copy_rows_sql(self):
+        columns = ', '.join(['sku_code'] + FTS_COLUMNS)
+        return f"INSERT INTO {FTS_TABLE} (rowid, {columns}) SELECT rowid, {columns} FROM {Product._meta.db_table}"
+
+    def rebuild(self):
+        connection = self.get_connection()
+        if not self.is_available(connection):
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(self.copy_rows_sql())
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'STOREFRONT_SEARCH_BACKEND', DEFAULT_BACKEND)
+        _backend = import_string(backend_path)()
+    return _backend
@@ -0,0 +1,165 @@
+"""Write-behind session engine: SESSION_ENGINE = 'storefront.sessions'.
+
+Sessions are read and written through SESSION_CACHE_ALIAS like cached_db, but an update only
+marks the session dirty. A background thread per process writes dirty sessions to the database
+in one bulk UPDATE every SESSION_WRITE_BEHIND_INTERVAL seconds. New sessions and deletes (logout)
+still hit the database synchronously.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.db import DatabaseError, close_old_connections, router, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_MAX_PENDING = 1000
+TOMBSTONE_PREFIX = 'storefront.sessions.deleted:'
+
+
+def get_interval():
+    return getattr(settings, 'SESSION_WRITE_BEHIND_INTERVAL', DEFAULT_INTERVAL)
+
+
+class SessionWriter:
+    """Dirty sessions waiting for the database, keyed by session key so only the latest copy is written."""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        # started lazily, and again in a forked worker process that did not inherit the thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, session):
+        self._ensure_worker()
+        with self._lock:
+            self._pending[session.session_key] = session
+            pending = len(self._pending)
+        if pending >= getattr(settings, 'SESSION_WRITE_BEHIND_MAX_PENDING', DEFAULT_MAX_PENDING):
+            # back pressure: the writer fell behind, this request pays for the flush
+            self.flush()
+
+    def discard(self, session_key):
+        with self._lock:
+            self._pending.pop(session_key, None)
+
+    def get(self, session_key):
+        # the queued copy of a session, newer than its database row
+        with self._lock:
+            return self._pending.get(session_key)
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write every pending session now, returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            sessions = list(batch.values())
+            model = sessions[0].__class__
+            try:
+                # an UPDATE, never an insert: a session deleted meanwhile (logout) stays deleted
+                with transaction.atomic(using=router.db_for_write(model)):
+                    model.objects.bulk_update(sessions, ['session_data', 'expire_date'], batch_size=500)
+            except DatabaseError:
+                logger.exception("Could not write %d sessions, keeping them for the next flush", len(batch))
+                with self._lock:
+                    # anything saved since is newer than what failed
+                    self._pending = {**batch, **self._pending}
+                return 0
+            return len(batch)
+
+    def _run(self):
+        while True:
+            time.sleep(get_interval() or DEFAULT_INTERVAL)
+            # the writer thread holds its own connection, respect CONN_MAX_AGE like a request would
+            close_old_connections()
+            self.flush()
+
+
+writer = SessionWriter()
+# a clean shutdown loses nothing
+atexit.register(writer.flush)
+
+
+class SessionStore(CachedDBStore):
+
+    def tombstone_key(self, session_key):
+        return TOMBSTONE_PREFIX + session_key
+
+    def _get_pending_session(self):
+        # load() falls back to the database when the cache entry was evicted, a write still
+        # queued in this process is newer than that row. Returns False when nothing is queued
+        pending = writer.get(self.session_key)
+        if pending is None:
+            return False
+        if pending.expire_date <= timezone.now():
+            self._session_key = None
+            return None
+        return pending
+
+    def _get_session_from_db(self):
+        pending = self._get_pending_session()
+        return super()._get_session_from_db() if pending is False else pending
+
+    async def _aget_session_from_db(self):
+        pending = self._get_pending_session()
+        return await super()._aget_session_from_db() if pending is False else pending
+
+    def exists(self, session_key):
+        return bool(session_key) and writer.get(session_key) is not None or super().exists(session_key)
+
+    async def aexists(self, session_key):
+        return bool(session_key) and writer.get(session_key) is not None or await super().aexists(session_key)
+
+    def save(self, must_create=False):
+        # new sessions need the database's uniqueness check, keep them synchronous
+        if must_create or self.session_key is None or get_interval() <= 0:
+            return super().save(must_create)
+
+        # the db engine raises UpdateError for a session deleted by a concurrent request,
+        # the tombstone keeps a logout from being undone by a write-behind save
+        if self._cache.get(self.tombstone_key(self.session_key)):
+            raise UpdateError
+        data = self._get_session()
+        try:
+            self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+        except Exception:
+            logger.exception("Error saving to cache (%s), writing the session through", self._cache)
+            return super().save(must_create)
+        writer.enqueue(self.create_model_instance(data))
+
+    async def asave(self, must_create=False):
+        await sync_to_async(self.save)(must_create)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            writer.discard(session_key)
+            self._cache.set(self.tombstone_key(session_key), True, settings.SESSION_COOKIE_AGE)
+        super().delete(session_key)
+
+    async def adelete(self, session_key=None):
+        await sync_to_async(self.delete)(session_key)
@@ -0,0 +1,41 @@
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .models import Product
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, created=False, raw=False, **kwargs):
+    bump_catalog_version()
+    # fixtures (raw saves) are indexed by rebuilding once they are loaded
+    if raw:
+        return
+    get_search_backend().index_product(instance, created=created)
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    # the index row is found through the product's rowid, so this runs while the product still exists
+    get_search_backend().remove_product(instance.sku_code)
+
+
+@receiver(post_delete, sender=Product)
+def bump_version_after_delete(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@contextmanager
+def product_delete_signals_disconnected():
+    # for bulk deletes that update the search index and bump the version once themselves,
+    # instead of once per product. Disconnects for the whole process, so only for commands
+    pre_delete.disconnect(unindex_deleted_product, sender=Product)
+    post_delete.disconnect(bump_version_after_delete, sender=Product)
+    try:
+        yield
+    finally:
+        pre_delete.connect(unindex_deleted_product, sender=Product)
+        post_delete.connect(bump_version_after_delete, sender=Product)
@@ -0,0 +1,96 @@
+// Product details are fetched when a card is opened instead of being inlined in the listing.
+// Without JavaScript the card link still works and opens the detail fragment directly.
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('.product-link');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+
+    var content = document.getElementById('product-modal-content');
+    fetch(link.href, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            content.innerHTML = html;
+            window.location.hash = 'product-modal';
+        })
+        .catch(function () {
+            window.location.href = link.href;
+        });
+});
+
+// Search-as-you-type suggestions from the in-memory prefix index.
+(function () {
+    var input = document.querySelector('.search-bar[data-suggest-url]');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('list'));
+    var pending = null;
+
+    input.addEventListener('input', function () {
+        var prefix = input.value.trim();
+        if (pending) {
+            pending.abort();
+        }
+        if (!prefix) {
+            list.innerHTML = '';
+            return;
+        }
+        pending = new AbortController();
+        fetch(input.dataset.suggestUrl + '?q=' + encodeURIComponent(prefix), {signal: pending.signal})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                list.innerHTML = '';
+                data.suggestions.forEach(function (suggestion) {
+                    var option = document.createElement('option');
+                    option.value = suggestion.label;
+                    list.appendChild(option);
+                });
+            })
+            .catch(function () {});
+    });
+})();
+
+// Add to cart through the JSON cart API, the plain form post stays as the fallback.
+(function () {
+    var form = document.getElementById('add-to-cart-form');
+    if (!form || !form.dataset.cartApi) {
+        return;
+    }
+    var useFallback = false;
+
+    form.addEventListener('submit', function (event) {
+        var button = event.submitter;
+        if (useFallback || !button) {
+            return;
+        }
+        event.preventDefault();
+        fetch(form.dataset.cartApi, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': form.querySelector('[name=csrfmiddlewaretoken]').value
+            },
+            body: JSON.stringify({operations: [{sku_code: button.value, delta: 1}]})
+        })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.json();
+            })
+            .then(function (cart) {
+                document.getElementById('cart-count').textContent = cart.item_count;
+            })
+            .catch(function () {
+                useFallback = true;
+                form.requestSubmit(button);
+            });
+    });
+})();
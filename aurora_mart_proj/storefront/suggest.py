@@ -0,0 +1,158 @@
+import heapq
+import logging
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+
+from .cache import get_catalog_version
+from .models import Product
+
+MAX_SUGGESTIONS = 10
+# a lookup scans at most this many index entries, any prefix matching more has its top results precomputed
+SCAN_LIMIT = 256
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over product names, categories and subcategories.
+
+    Every word of a name is a starting point, so "head" finds "Wireless Headphones".
+    Entries are (key, rating, kind, label, value) and results are ranked by rating.
+    """
+
+    def __init__(self, entries):
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+        self.top = {}
+        self._precompute_heavy_prefixes()
+
+    def _best(self, start, end):
+        return heapq.nlargest(MAX_SUGGESTIONS * 2, (self.entries[i][1:] for i in range(start, end)))
+
+    def _precompute_heavy_prefixes(self):
+        # walks the prefix tree over the sorted keys, only descending into prefixes that match
+        # more than SCAN_LIMIT entries. Ranges nest, so every such prefix is reached, and each
+        # level of the walk touches every entry at most once
+        keys = self.keys
+        stack = [('', 0, len(keys))]
+        while stack:
+            prefix, start, end = stack.pop()
+            if end - start <= SCAN_LIMIT:
+                continue
+            if prefix:
+                self.top[prefix] = self._best(start, end)
+            depth = len(prefix)
+            i = start
+            # keys equal to the prefix sort first and cannot be extended
+            while i < end and len(keys[i]) == depth:
+                i += 1
+            while i < end:
+                child = keys[i][:depth + 1]
+                j = bisect_left(keys, child + '\uffff', lo=i, hi=end)
+                stack.append((child, i, j))
+                i = j
+
+    def lookup(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        candidates = self.top.get(prefix)
+        if candidates is None:
+            # not precomputed, so at most SCAN_LIMIT entries match
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\uffff', lo=start)
+            candidates = self._best(start, end)
+
+        # several words of one product can match the same prefix, keep the first (best) hit
+        results = []
+        seen = set()
+        for rating, kind, label, value in candidates:
+            if (kind, value) in seen:
+                continue
+            seen.add((kind, value))
+            results.append({'type': kind, 'label': label, 'value': value, 'rating': rating})
+            if len(results) == limit:
+                break
+        return results
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def word_suffixes(text):
+    words = normalize(text).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+def build_index():
+    entries = []
+    best_rating = {}
+    rows = Product.objects.order_by().values_list(
+        'sku_code', 'product_name', 'product_category', 'product_subcategory', 'product_rating',
+    )
+    for sku_code, name, category, subcategory, rating in rows.iterator(chunk_size=2000):
+        for key in word_suffixes(name):
+            entries.append((key, rating, 'product', name, sku_code))
+        # categories rank by their best product
+        for kind, label in (('category', category), ('subcategory', subcategory)):
+            if rating > best_rating.get((kind, label), float('-inf')):
+                best_rating[(kind, label)] = rating
+    for (kind, label), rating in best_rating.items():
+        for key in word_suffixes(label):
+            entries.append((key, rating, kind, label, label))
+    return PrefixIndex(entries)
+
+
+_index = None
+_index_version = None
+_rebuilding = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """The index for the current catalog version, or the previous one while it is rebuilt."""
+    global _index, _index_version
+    version = get_catalog_version()
+    if _index is not None and _index_version == version:
+        return _index
+    if _index is None or not getattr(settings, 'STOREFRONT_SUGGEST_BACKGROUND_REBUILD', True):
+        # nothing to serve yet (or rebuilds are inline), this request builds it
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = build_index()
+                _index_version = version
+        return _index
+    # a catalog write should not make the next keystroke wait for a full rebuild
+    start_rebuild(version)
+    return _index
+
+
+def start_rebuild(version):
+    global _rebuilding
+    with _lock:
+        if _rebuilding is None or not _rebuilding.is_alive():
+            _rebuilding = threading.Thread(target=_rebuild, args=(version,), name='suggest-index', daemon=True)
+            _rebuilding.start()
+        return _rebuilding
+
+
+def _rebuild(version):
+    global _index, _index_version
+    try:
+        index = build_index()
+        with _lock:
+            # writes during the build moved the version on, the next lookup starts another rebuild
+            _index, _index_version = index, version
+    except Exception:
+        logger.exception("Could not rebuild the suggestion index, serving the previous one")
+    finally:
+        connections.close_all()
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    return get_index().lookup(prefix, max(1, min(limit, MAX_SUGGESTIONS)))
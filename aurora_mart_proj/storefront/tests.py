@@ -1,3 +1,1108 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from aurora_mart_proj.metrics import PerformanceMiddleware, registry as metrics_registry
+from authentication.models import UserProfile
+
+from . import async_views
+from .api import PRODUCT_FIELDS
+from .associations import mine_rules, related_products, store_rules
+from .cache import bump_catalog_version, get_catalog_version, get_stock_version
+from .facets import get_category_facets
+from .inventory import (
+    InsufficientStock, confirm_reservation, release_expired_reservations, release_reservation, reserve_stock,
+)
+from .loadtest import (
+    ONBOARDING_PREFIX, EndpointError, endpoint_scenarios, find_regressions, generate_dataset, run_endpoints,
+)
+from .models import Product, ProductAssociation, StockReservation
+from .pagination import SORT_OPTIONS, SEARCH_SORT, decode_cursor, encode_cursor, keyset_page
+from .routers import REPLICA_ALIAS
+from .search import FTS_TABLE, FTS5SearchBackend, get_search_backend
+from .sessions import SessionStore, writer as session_writer
+from . import suggest as suggest_module
+from .suggest import SCAN_LIMIT, PrefixIndex, suggest
+from .urls import storefront_urlpatterns
+from .views import get_product_detail
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ['Books', 'Electronics', 'Home & Kitchen']
+
+
+def make_products(count):
+    Product.objects.bulk_create([
+        Product(
+            sku_code=f'SKU-{i:05d}',
+            product_name=f'Product {i % 37}',
+            product_description=f'Description of product {i}',
+            product_category=CATEGORIES[i % len(CATEGORIES)],
+            product_subcategory=f'Sub {i % 5}',
+            quantity_on_hand=i % 50,
+            reorder_quantity=10,
+            unit_price=Decimal(i % 97) + Decimal('0.99'),
+            product_rating=(i % 50) / 10,
+        )
+        for i in range(count)
+    ])
+
+
+class CatalogQueryPlanTests(TestCase):
+    # every listing query the storefront view can issue has to be served by an index,
+    # in index order - no full table scan and no temp B-tree for the ORDER BY
+
+    @classmethod
+    def setUpTestData(cls):
+        make_products(300)
+
+    def setUp(self):
+        cache.clear()
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def listing_queries(self, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('storefront_home'), params)
+        self.assertEqual(response.status_code, 200)
+        table = Product._meta.db_table
+        return response, [
+            query['sql'] for query in ctx.captured_queries
+            if f'FROM "{table}"' in query['sql'] and 'ORDER BY' in query['sql'] and 'GROUP BY' not in query['sql']
+        ]
+
+    def assertIndexedPlan(self, sql, label, params=()):
+        plan = self.explain(sql, params)
+        table = Product._meta.db_table
+        for detail in plan:
+            self.assertNotIn('USE TEMP B-TREE', detail, f'{label}: temp sort in {plan}\n{sql}')
+            self.assertNotEqual(detail, f'SCAN {table}', f'{label}: full table scan in {plan}\n{sql}')
+
+    def test_every_sort_and_filter_uses_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plans are checked against SQLite')
+        for category in ['All'] + CATEGORIES:
+            for sort in SORT_OPTIONS:
+                if sort == SEARCH_SORT:
+                    continue
+                params = {'category': category, 'sort': sort}
+                label = f'category={category} sort={sort}'
+                response, queries = self.listing_queries(params)
+                self.assertTrue(queries, label)
+                for sql in queries:
+                    self.assertIndexedPlan(sql, label)
+
+                # the page after a cursor has to seek through the same index
+                next_cursor = response.context['next_cursor']
+                self.assertIsNotNone(next_cursor, label)
+                _, queries = self.listing_queries({**params, 'after': next_cursor})
+                self.assertTrue(queries, label)
+                for sql in queries:
+                    self.assertIndexedPlan(sql, f'{label} (second page)')
+
+    def test_default_model_ordering_uses_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plans are checked against SQLite')
+        for category in CATEGORIES:
+            sql, params = Product.objects.filter(product_category=category)[:10].query.sql_with_params()
+            self.assertIndexedPlan(sql, f'Meta.ordering category={category}', params)
+
+
+class KeysetPaginationTests(TestCase):
+    # make_products repeats names, prices and ratings, so every sort has ties for sku_code to break
+
+    @classmethod
+    def setUpTestData(cls):
+        make_products(120)
+
+    def walk(self, sort, page_size=7):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(Product.objects.all(), sort, cursor, page_size)
+            self.assertLessEqual(len(rows), page_size)
+            seen += [row.sku_code for row in rows]
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_row_once_in_sort_order(self):
+        for sort, (field, descending) in SORT_OPTIONS.items():
+            if sort == SEARCH_SORT:
+                continue
+            prefix = '-' if descending else ''
+            expected = list(
+                Product.objects.order_by(prefix + field, prefix + 'sku_code').values_list('sku_code', flat=True)
+            )
+            self.assertEqual(self.walk(sort), expected, sort)
+
+    def test_ties_continue_on_the_sku_tie_breaker(self):
+        # every product sharing one name, the cursor value alone cannot tell the pages apart
+        Product.objects.update(product_name='Same name')
+        self.assertEqual(self.walk('name-desc'), sorted(Product.objects.values_list('sku_code', flat=True), reverse=True))
+        self.assertEqual(self.walk('name-asc'), sorted(Product.objects.values_list('sku_code', flat=True)))
+
+    def test_last_page_has_no_cursor(self):
+        rows, cursor = keyset_page(Product.objects.all(), 'price-asc', None, 120)
+        self.assertEqual(len(rows), 120)
+        self.assertIsNone(cursor)
+
+    def test_malformed_or_tampered_cursors_start_from_the_first_page(self):
+        first_page, _ = keyset_page(Product.objects.all(), 'price-asc', None, 5)
+        for cursor in [
+            'not base64 at all!', encode_cursor('just a string'), encode_cursor([1, 2, 3]),
+            encode_cursor(['not a price', 'SKU-00001']), encode_cursor([{'a': 1}, ['SKU']]),
+            encode_cursor([None, None]), encode_cursor(['1.99', {'sku': 1}]), encode_cursor(['1.99', 5]),
+            '\u00e9\u00e9\u00e9',
+        ]:
+            rows, _ = keyset_page(Product.objects.all(), 'price-asc', cursor, 5)
+            self.assertEqual(rows, first_page, cursor)
+
+    def test_tampered_cursor_in_the_view_is_not_an_error(self):
+        response = self.client.get(reverse('storefront_home'), {'sort': 'rating-desc', 'after': encode_cursor([[1], {}])})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['products'])
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(['12.99', 'SKU-00042'])), ['12.99', 'SKU-00042'])
+        self.assertIsNone(decode_cursor(''))
+
+
+class CategoryFacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(30)
+
+    def test_facets_are_cached_until_a_product_changes(self):
+        facets = get_category_facets()
+        self.assertEqual([facet['name'] for facet in facets], CATEGORIES)
+        self.assertEqual(sum(facet['count'] for facet in facets), 30)
+        books = facets[0]
+        self.assertEqual(books['count'], sum(sub['count'] for sub in books['subcategories']))
+
+        with self.assertNumQueries(0):
+            get_category_facets()
+
+        Product.objects.get(sku_code='SKU-00000').delete()
+        self.assertEqual(sum(facet['count'] for facet in get_category_facets()), 29)
+
+
+class ProductGridCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(30)
+
+    def grid_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('storefront_home'), {'category': 'Books', 'sort': 'price-asc'})
+        self.assertEqual(response.status_code, 200)
+        table = Product._meta.db_table
+        return response, [q for q in ctx.captured_queries if f'FROM "{table}"' in q['sql']]
+
+    def test_grid_is_served_from_cache_until_the_catalog_changes(self):
+        for backend in ['django.core.cache.backends.locmem.LocMemCache',
+                        'django.core.cache.backends.filebased.FileBasedCache']:
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as location:
+                with self.settings(CACHES={'default': {'BACKEND': backend, 'LOCATION': location}}):
+                    _, queries = self.grid_queries()
+                    self.assertTrue(queries)
+
+                    response, queries = self.grid_queries()
+                    self.assertEqual(queries, [])
+                    self.assertContains(response, 'SKU-00003')
+
+                    product = Product.objects.get(sku_code='SKU-00003')
+                    product.product_name = 'Renamed product'
+                    product.save()
+                    response, queries = self.grid_queries()
+                    self.assertTrue(queries)
+                    self.assertContains(response, 'Renamed product')
+
+    def test_cached_grid_holds_no_csrf_token(self):
+        self.client.get(reverse('storefront_home'))
+        response = self.client.get(reverse('storefront_home'))
+        grid = response.context['product_grid']
+        self.assertNotIn('csrfmiddlewaretoken', grid)
+        self.assertContains(response, 'csrfmiddlewaretoken', count=1)
+
+
+class ProductDetailTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(3)
+
+    def test_listing_leaves_the_description_to_the_detail_endpoint(self):
+        response = self.client.get(reverse('storefront_home'))
+        self.assertNotContains(response, 'Description of product 1')
+        self.assertContains(response, reverse('product_detail', args=['SKU-00001']))
+
+    def test_detail_fragment_and_json(self):
+        url = reverse('product_detail', args=['SKU-00001'])
+        response = self.client.get(url)
+        self.assertContains(response, 'Description of product 1')
+        self.assertIn('public', response['Cache-Control'])
+
+        response = self.client.get(url, {'format': 'json'})
+        self.assertEqual(response.json()['product_description'], 'Description of product 1')
+        self.assertEqual(response.json()['unit_price'], '1.99')
+
+        self.assertEqual(self.client.get(reverse('product_detail', args=['NOPE'])).status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('product_detail', args=['SKU-00001'])
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # the JSON representation has its own validator
+        self.assertEqual(self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        product = Product.objects.get(sku_code='SKU-00001')
+        product.product_description = 'Updated description'
+        product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Updated description')
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(3)
+
+    def assertNotModified(self, url, etag, params=None):
+        table = Product._meta.db_table
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params or {}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if table in q['sql']])
+
+    def test_storefront_revalidates_until_catalog_or_cart_changes(self):
+        url = reverse('storefront_home')
+        params = {'category': 'Books', 'sort': 'price-asc'}
+        self.client.get(url, params)  # sets the CSRF cookie
+        etag = self.client.get(url, params)['ETag']
+        self.assertNotModified(url, etag, params)
+
+        # other parameters, a cart change or a catalog write all give a new page
+        self.assertEqual(self.client.get(url, {'sort': 'price-desc'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Product.objects.filter(pk='SKU-00000').first().save()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url, params)['ETag']
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        # the "added to cart" message is pending, it has to be rendered
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag_with_cart = self.client.get(url, params)['ETag']
+        self.assertNotEqual(etag, etag_with_cart)
+        self.assertNotModified(url, etag_with_cart, params)
+
+    def test_cart_revalidates_until_cart_changes(self):
+        url = reverse('view_cart')
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        self.client.get(url)  # sets the CSRF cookie
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, etag)
+
+        self.client.post(reverse('update_cart'), {'sku_code': 'SKU-00000', 'quantity': 3})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_renders_pending_messages(self):
+        url = reverse('view_cart')
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        # SKU-00000 is out of stock, the cart stays the same but the error has to be shown
+        self.client.post(reverse('checkout'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'not enough stock')
+
+
+class ProductFeedTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(30)
+
+    def get_feed(self, **params):
+        response = self.client.get(reverse('product_feed'), params)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_feed_matches_storefront_filters_and_sorts(self):
+        rows = self.get_feed(category='Books', sort='price-desc', fields='sku_code,unit_price')
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(set(rows[0]), {'sku_code', 'unit_price'})
+        prices = [Decimal(row['unit_price']) for row in rows]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+        self.assertEqual(len(self.get_feed(limit=5)), 5)
+        self.assertEqual(set(self.get_feed()[0]), set(PRODUCT_FIELDS))
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(reverse('product_feed'), {'fields': 'sku_code,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_internal_columns_are_not_exported(self):
+        self.assertNotIn('row_fingerprint', self.get_feed()[0])
+        for field in ('row_fingerprint', 'reorder_quantity'):
+            response = self.client.get(reverse('product_feed'), {'fields': f'sku_code,{field}'})
+            self.assertEqual(response.status_code, 400)
+
+
+class FullTextSearchTests(TestCase):
+
+    def setUp(self):
+        if connection.vendor != 'sqlite' or not get_search_backend().is_available():
+            self.skipTest('needs SQLite with FTS5')
+        make_products(10)
+        get_search_backend().rebuild()
+        self.product('SKU-00001', 'Desk lamp', 'Lighting for a desk')
+        self.product('SKU-00002', 'Reading light', 'A small lamp for books')
+        self.product('SKU-00003', 'Lamp shade', 'Shade for a floor lamp, a lamp for every room')
+
+    def product(self, sku, name, description, category='Home & Kitchen'):
+        product = Product.objects.get(sku_code=sku)
+        product.product_name, product.product_description, product.product_category = name, description, category
+        product.save()
+
+    def skus(self, query, backend=None, products=None):
+        products = Product.objects.all() if products is None else products
+        return [p.sku_code for p in (backend or get_search_backend()).search(products, query).order_by('search_rank')]
+
+    def test_bm25_ranks_name_matches_above_description_matches(self):
+        skus = self.skus('lamp')
+        self.assertEqual(set(skus), {'SKU-00001', 'SKU-00002', 'SKU-00003'})
+        # a name hit outweighs any number of description hits
+        self.assertEqual(skus[-1], 'SKU-00002')
+
+    def test_index_follows_saves_and_deletes_by_rowid(self):
+        self.product('SKU-00001', 'Desk fan', 'Keeps you cool')
+        self.assertNotIn('SKU-00001', self.skus('lamp'))
+        self.assertEqual(self.skus('fan'), ['SKU-00001'])
+        Product.objects.get(sku_code='SKU-00003').delete()
+        self.assertEqual(self.skus('lamp'), ['SKU-00002'])
+        with connection.cursor() as cursor:
+            # one index row per product, stored under the product's own rowid
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} f JOIN storefront_product p '
+                'ON p.rowid = f.rowid AND p.sku_code = f.sku_code'
+            )
+            self.assertEqual(cursor.fetchone()[0], Product.objects.count())
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], Product.objects.count())
+
+    @override_settings(STOREFRONT_SEARCH_MAX_RESULTS=2)
+    def test_result_cap_applies_after_the_category_filter(self):
+        self.product('SKU-00004', 'Camping lamp', 'Battery powered', category='Sports')
+        backend = FTS5SearchBackend()
+        # the best two matches overall are both in Home & Kitchen
+        self.assertEqual(len(self.skus('lamp', backend)), 2)
+        self.assertEqual(self.skus('lamp', backend, Product.objects.filter(product_category='Sports')), ['SKU-00004'])
+
+    def test_icontains_fallback_without_fts5(self):
+        backend = FTS5SearchBackend()
+        backend._available[backend.get_connection().alias] = False
+        self.product('SKU-00005', 'Garden tools', 'Spade', category='Lamps and more')
+        with CaptureQueriesContext(connection) as queries:
+            skus = self.skus('lamp', backend)
+        self.assertFalse([q for q in queries if FTS_TABLE in q['sql']])
+        # names and categories only, name matches ranked first
+        self.assertEqual(sorted(skus[:2]), ['SKU-00001', 'SKU-00003'])
+        self.assertEqual(skus[2:], ['SKU-00005'])
+
+    def test_fts_errors_fall_back_to_icontains(self):
+        def broken(*args):
+            raise DatabaseError('fts5: syntax error')
+
+        backend = FTS5SearchBackend()
+        backend.ranked_skus = broken
+        with self.assertLogs('storefront.search', 'ERROR'):
+            self.assertEqual(sorted(self.skus('lamp', backend)), ['SKU-00001', 'SKU-00003'])
+
+
+@override_settings(STOREFRONT_SUGGEST_BACKGROUND_REBUILD=False)
+class SearchSuggestionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_products(30)
+        Product.objects.filter(sku_code='SKU-00007').update(product_name='Wireless Headphones', product_rating=4.9)
+        Product.objects.filter(sku_code='SKU-00008').update(product_name='Wired Headset', product_rating=3.0)
+        bump_catalog_version()
+
+    def test_suggestions_rank_by_rating_without_queries(self):
+        suggest('warm up')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('search_suggestions'), {'q': 'Head'})
+        labels = [s['label'] for s in response.json()['suggestions']]
+        self.assertEqual(labels, ['Wireless Headphones', 'Wired Headset'])
+
+        # longer prefixes go through the sorted array instead of the precomputed table
+        self.assertEqual([s['label'] for s in suggest('wireless headp')], ['Wireless Headphones'])
+        self.assertIn('Electronics', [s['label'] for s in suggest('electr')])
+
+    def test_index_follows_the_catalog_version(self):
+        self.assertEqual(suggest('zebra'), [])
+        Product.objects.create(
+            sku_code='SKU-Z', product_name='Zebra Mug', product_description='', product_category='Home & Kitchen',
+            product_subcategory='Mugs', quantity_on_hand=1, reorder_quantity=1, unit_price=Decimal('5.00'),
+            product_rating=4.0,
+        )
+        self.assertEqual([s['value'] for s in suggest('zeb')], ['SKU-Z'])
+
+    def test_long_prefixes_never_scan_more_than_the_limit(self):
+        # 2000 keys behind one long shared prefix, with the best ones in the middle
+        entries = [(f'premium camera {i:04d}', float(i % 97), 'product', f'Camera {i}', f'SKU-{i}') for i in range(2000)]
+        entries.append(('premium', 1.0, 'category', 'Premium', 'Premium'))
+        index = PrefixIndex(list(entries))
+
+        for prefix in ('p', 'premium', 'premium camera', 'premium camera 1', 'premium camera 19', 'premium camera 199'):
+            start = bisect_left(index.keys, prefix)
+            end = bisect_left(index.keys, prefix + '\uffff')
+            self.assertTrue(prefix in index.top or end - start <= SCAN_LIMIT, prefix)
+            expected = sorted((e for e in entries if e[0].startswith(prefix)), key=lambda e: e[1], reverse=True)[:5]
+            self.assertEqual([s['rating'] for s in index.lookup(prefix, 5)], [e[1] for e in expected])
+        self.assertEqual(index.lookup('premium camera 2', 5), [])
+
+
+class SuggestionRebuildTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        make_products(5)
+        bump_catalog_version()
+        # without an index the first lookup builds one inline
+        suggest_module._index = None
+
+    def test_catalog_writes_rebuild_the_index_in_the_background(self):
+        self.assertEqual(suggest('zebra'), [])
+        Product.objects.create(
+            sku_code='SKU-Z', product_name='Zebra Mug', product_description='', product_category='Home & Kitchen',
+            product_subcategory='Mugs', quantity_on_hand=1, reorder_quantity=1, unit_price=Decimal('5.00'),
+            product_rating=4.0,
+        )
+        # the request that notices the new version is answered from the previous index
+        self.assertEqual(suggest('zeb'), [])
+        suggest_module._rebuilding.join(timeout=10)
+        self.assertEqual([s['value'] for s in suggest('zeb')], ['SKU-Z'])
+
+
+class CartApiTests(TestCase):
+
+    def setUp(self):
+        make_products(5)
+
+    def post_operations(self, operations):
+        return self.client.post(reverse('cart_api'), {'operations': operations}, content_type='application/json')
+
+    def test_batch_of_operations_in_one_request(self):
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00001'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_operations([
+                {'sku_code': 'SKU-00001', 'delta': 2},
+                {'sku_code': 'SKU-00002', 'quantity': 4},
+                {'sku_code': 'SKU-00003', 'delta': 1},
+                {'sku_code': 'SKU-00003', 'delta': -1},
+            ])
+        product_queries = [q for q in ctx.captured_queries if Product._meta.db_table in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        cart = response.json()
+        self.assertEqual({line['sku_code']: line['quantity'] for line in cart['lines']}, {'SKU-00001': 3, 'SKU-00002': 4})
+        self.assertEqual(cart['item_count'], 7)
+        self.assertEqual(Decimal(cart['total']), Decimal('1.99') * 3 + Decimal('2.99') * 4)
+        self.assertEqual(self.client.session['cart'], {'SKU-00001': 3, 'SKU-00002': 4})
+
+    def test_unknown_skus_and_bad_payloads(self):
+        cart = self.post_operations([{'sku_code': 'NOPE', 'delta': 1}]).json()
+        self.assertEqual(cart['lines'], [])
+        self.assertEqual(len(cart['errors']), 1)
+        self.assertEqual(self.client.session['cart'], {})
+
+        self.assertEqual(self.post_operations([{'sku_code': 'SKU-00001', 'delta': 'x'}]).status_code, 400)
+        response = self.client.post(
+            reverse('cart_api'), '{"operations": [{"sku_code": "SKU-00001", "quantity": 1e400}]}',
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_operations('nope').status_code, 400)
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        make_products(3)
+        Product.objects.update(quantity_on_hand=5)
+
+    def stock(self, sku):
+        return Product.objects.get(sku_code=sku).quantity_on_hand
+
+    def test_reservation_is_all_or_nothing(self):
+        reference = reserve_stock({'SKU-00000': 2, 'SKU-00001': 5})
+        self.assertEqual((self.stock('SKU-00000'), self.stock('SKU-00001')), (3, 0))
+
+        with self.assertRaises(InsufficientStock):
+            reserve_stock({'SKU-00000': 1, 'SKU-00001': 1})
+        self.assertEqual(self.stock('SKU-00000'), 3)
+
+        self.assertEqual(release_reservation(reference), 2)
+        self.assertEqual((self.stock('SKU-00000'), self.stock('SKU-00001')), (5, 5))
+        self.assertEqual(release_reservation(reference), 0)
+
+    def test_stock_changes_renew_only_what_shows_stock(self):
+        cache.clear()
+        self.assertEqual(get_product_detail('SKU-00000')['quantity_on_hand'], 5)
+        get_category_facets()
+        version = get_catalog_version()
+        stock_version = get_stock_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reference = reserve_stock({'SKU-00000': 2})
+        self.assertGreater(get_stock_version(), stock_version)
+        self.assertEqual(get_product_detail('SKU-00000')['quantity_on_hand'], 3)
+        # facets and suggestions are keyed on the catalog version, a checkout leaves them cached
+        self.assertEqual(get_catalog_version(), version)
+        with self.assertNumQueries(0):
+            get_category_facets()
+
+        stock_version = get_stock_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            release_reservation(reference)
+        self.assertGreater(get_stock_version(), stock_version)
+        self.assertEqual(get_product_detail('SKU-00000')['quantity_on_hand'], 5)
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_expired_reservations_are_released_in_bulk(self):
+        reserve_stock({'SKU-00000': 1}, ttl=timedelta(minutes=-1))
+        reserve_stock({'SKU-00000': 2, 'SKU-00002': 1}, ttl=timedelta(minutes=-1))
+        kept = reserve_stock({'SKU-00002': 3})
+
+        self.assertEqual(release_expired_reservations(), 3)
+        self.assertEqual((self.stock('SKU-00000'), self.stock('SKU-00002')), (5, 2))
+        self.assertEqual(StockReservation.objects.get().reference, kept)
+
+        self.assertEqual(confirm_reservation(kept), 1)
+        self.assertEqual(self.stock('SKU-00002'), 2)
+
+    def test_checkout_reserves_the_cart(self):
+        self.client.post(reverse('cart_api'), {'operations': [{'sku_code': 'SKU-00000', 'quantity': 4}]},
+                         content_type='application/json')
+        self.client.post(reverse('checkout'))
+        self.assertEqual(self.stock('SKU-00000'), 1)
+        # checking out again swaps the hold instead of taking the stock twice
+        response = self.client.post(reverse('checkout'), follow=True)
+        self.assertEqual(self.stock('SKU-00000'), 1)
+        self.assertContains(response, 'reserved')
+
+
+class FrequentlyBoughtTogetherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_products(6)
+        # 0 and 1 are almost always bought together, 2 only sometimes joins them
+        self.baskets = (
+            [{'SKU-00000', 'SKU-00001'}] * 8
+            + [{'SKU-00000', 'SKU-00001', 'SKU-00002'}] * 2
+            + [{'SKU-00003', 'SKU-00004'}] * 3
+            + [{'SKU-00005'}]
+        )
+
+    def test_mined_rules_rank_strongest_pair_first(self):
+        rules = mine_rules(self.baskets, min_support=0.1, min_confidence=0.2)
+        self.assertEqual(rules['SKU-00000'][0][0], 'SKU-00001')
+        self.assertAlmostEqual(rules['SKU-00000'][0][1], 1.0)
+        self.assertNotIn('SKU-00005', rules)
+
+    def test_related_products_are_an_indexed_lookup(self):
+        store_rules(mine_rules(self.baskets, min_support=0.1, min_confidence=0.2))
+        with self.assertNumQueries(1):
+            related = related_products(['SKU-00000'])
+        self.assertEqual([product.sku_code for product in related][0], 'SKU-00001')
+        # items already in the basket are never recommended back
+        related = related_products(['SKU-00000', 'SKU-00001'])
+        self.assertEqual([product.sku_code for product in related], ['SKU-00002'])
+
+    def test_endpoint_and_cart(self):
+        store_rules(mine_rules(self.baskets, min_support=0.1, min_confidence=0.2))
+        response = self.client.get(reverse('frequently_bought_together', args=['SKU-00003']))
+        self.assertEqual([p['sku_code'] for p in response.json()['products']], ['SKU-00004'])
+
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00003'})
+        response = self.client.get(reverse('view_cart'))
+        self.assertContains(response, 'Frequently bought together')
+        self.assertEqual([p.sku_code for p in response.context['recommendations']], ['SKU-00004'])
+
+    def test_rules_naming_discontinued_skus(self):
+        rules = mine_rules(self.baskets + [{'SKU-00003', 'GONE-1'}] * 5, min_support=0.1, min_confidence=0.2)
+        self.assertIn('GONE-1', rules)
+        stored, dropped = store_rules(rules)
+        self.assertEqual(dropped, 1)
+        self.assertFalse(ProductAssociation.objects.filter(related_id='GONE-1').exists())
+        self.assertEqual(ProductAssociation.objects.count(), stored)
+        self.assertTrue(ProductAssociation.objects.filter(product_id='SKU-00003', related_id='SKU-00004').exists())
+
+    def test_mine_associations_command_reports_dropped_skus(self):
+        path = os.path.join(tempfile.mkdtemp(), 'orders.csv')
+        self.addCleanup(os.remove, path)
+        with open(path, 'w', newline='') as f:
+            f.write('order_id,sku_code\n' + ''.join(f'{i},SKU-00000\n{i},GONE-1\n{i},SKU-00001\n' for i in range(5)))
+        out = StringIO()
+        call_command('mine_associations', '--csv', path, '--min-support', '0.1', stdout=out)
+        self.assertIn('Dropped 1 SKUs', out.getvalue())
+        self.assertEqual(ProductAssociation.objects.get(product_id='SKU-00000').related_id, 'SKU-00001')
+
+    def test_mine_associations_command(self):
+        StockReservation.objects.bulk_create([
+            StockReservation(reference=f'r{i}', product_id=sku, quantity=1, expires_at=timezone.now())
+            for i in range(5) for sku in ('SKU-00000', 'SKU-00002')
+        ])
+        out = StringIO()
+        call_command('mine_associations', '--min-support', '0.1', stdout=out)
+        self.assertIn('5 baskets', out.getvalue())
+        self.assertEqual(ProductAssociation.objects.filter(product_id='SKU-00000').get().related_id, 'SKU-00002')
+
+        # the holds are gone (all confirmed), an empty run must not wipe the rules
+        StockReservation.objects.all().delete()
+        out = StringIO()
+        call_command('mine_associations', '--min-support', '0.1', stdout=out)
+        self.assertIn('keeping the stored associations', out.getvalue())
+        self.assertEqual(store_rules({}), (0, 0))
+        self.assertEqual(ProductAssociation.objects.count(), 2)
+
+
+PRODUCT_CSV_HEADER = (
+    'SKU code,Product name,Product description,Product Category,Product Subcategory,'
+    'Quantity on hand,Reorder Quantity,Unit price,Product rating\n'
+)
+
+
+class LoadProductsTests(TestCase):
+    def write_csv(self, rows):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='cp1252', newline='', delete=False)
+        self.addCleanup(os.remove, f.name)
+        with f:
+            f.write(PRODUCT_CSV_HEADER + ''.join(rows))
+        return f.name
+
+    def load(self, path, *args):
+        out = StringIO()
+        call_command('load_products', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_rerun_updates_in_place(self):
+        rows = [f'LD-{i},Caf\xe9 {i},Desc,Books,Fiction,{i},5,{i}.10,4.5\n' for i in range(25)]
+        path = self.write_csv(rows)
+        output = self.load(path, '--batch-size', '10')
+        self.assertIn('Read 25 products', output)
+        self.assertIn('rows/sec', output)
+
+        rows[3] = 'LD-3,Renamed,Desc,Books,Fiction,99,5,19.99,4.5\n'
+        self.load(self.write_csv(rows), '--batch-size', '10')
+        self.assertEqual(Product.objects.count(), 25)
+        product = Product.objects.get(sku_code='LD-3')
+        self.assertEqual((product.product_name, product.quantity_on_hand), ('Renamed', 99))
+        self.assertEqual(Product.objects.get(sku_code='LD-1').product_name, 'Caf\xe9 1')
+
+    def test_delta_load_touches_only_changed_rows(self):
+        rows = [f'LD-{i},Product {i},Desc,Books,Fiction,{i},5,{i}.10,4.5\n' for i in range(10)]
+        self.load(self.write_csv(rows))
+
+        rows[2] = 'LD-2,Product 2,Desc,Books,Fiction,2,5,2.10,4.5\n'  # same content, rewritten
+        rows[4] = 'LD-4,Searchable Lamp,Desc,Books,Fiction,4,5,4.10,4.5\n'
+        rows[9] = 'LD-NEW,New thing,Desc,Books,Fiction,1,5,1.00,4.0\n'
+        version = get_catalog_version()
+        with CaptureQueriesContext(connection) as queries:
+            output = self.load(self.write_csv(rows), '--delete-missing')
+        self.assertIn('1 inserted, 1 changed, 8 unchanged, 1 deleted', output)
+        upserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "storefront_product"')]
+        self.assertEqual(len(upserts), 1)
+        self.assertEqual(upserts[0].count('LD-'), 2)
+
+        self.assertFalse(Product.objects.filter(sku_code='LD-9').exists())
+        # one bump for the whole run, not one per deleted product
+        self.assertEqual(get_catalog_version(), version + 1)
+        self.assertEqual(
+            [p.sku_code for p in get_search_backend().search(Product.objects.all(), 'lamp')], ['LD-4'],
+        )
+
+        output = self.load(self.write_csv(rows))
+        self.assertIn('0 inserted, 0 changed, 10 unchanged', output)
+
+    def test_prices_are_exact_decimals(self):
+        self.load(self.write_csv(['LD-1,A,Desc,Books,Fiction,1,1,1.15,4\n', 'LD-2,B,Desc,Books,Fiction,1,1,2675.01,4\n']))
+        prices = dict(Product.objects.values_list('sku_code', 'unit_price'))
+        self.assertEqual(prices, {'LD-1': Decimal('1.15'), 'LD-2': Decimal('2675.01')})
+
+    def test_bad_row_reports_line(self):
+        path = self.write_csv(['LD-1,A,Desc,Books,Fiction,1,1,1.15,4\n', 'LD-2,B,Desc,Books,Fiction,lots,1,2.00,4\n'])
+        with self.assertRaisesMessage(CommandError, 'Line 3'):
+            self.load(path)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    ML_MODELS={'preferred_category': '/nonexistent/model.joblib'},
+)
+class EndpointBenchmarkTests(TestCase):
+    # queries are counted on every alias
+    databases = {'default', 'replica'}
+
+    def test_dataset_is_topped_up_and_trimmed(self):
+        generate_dataset(30)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(User.objects.count(), 30)
+        # every tenth user still has to onboard
+        self.assertEqual(UserProfile.objects.count(), 27)
+
+        generate_dataset(40)
+        self.assertEqual(Product.objects.count(), 40)
+        generate_dataset(20)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(User.objects.count(), 20)
+
+    def test_every_endpoint_is_measured(self):
+        generate_dataset(30)
+        # no model is deployed here, onboarding predicts with the fixture model
+        with self.assertNoLogs('authentication.views', 'ERROR'), self.assertNoLogs('aurora_mart_proj.metrics'):
+            results = run_endpoints(30, 3)
+
+        self.assertEqual(list(results), [name for name, _ in endpoint_scenarios()])
+        for name, result in results.items():
+            self.assertEqual(result['requests'], 3, name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertGreater(results['checkout']['queries'], 0)
+        # every sort runs its own query instead of hitting the grid the category tab cached
+        for sort in SORT_OPTIONS:
+            if sort != SEARCH_SORT:
+                self.assertGreater(results[f'sort_{sort}']['queries'], 0, sort)
+        self.assertFalse(User.objects.filter(username__startswith=ONBOARDING_PREFIX).exists())
+
+    def test_onboarding_without_a_prediction_fails(self):
+        generate_dataset(10)
+        with tempfile.NamedTemporaryFile('w', suffix='.joblib') as broken:
+            broken.write('not a model')
+            broken.flush()
+            with override_settings(ML_MODELS={'preferred_category': broken.name}):
+                with self.assertLogs('authentication.views', 'ERROR'), self.assertRaisesMessage(EndpointError, 'fell back'):
+                    run_endpoints(10, 1, ['onboarding'])
+
+    def test_regressions_against_the_baseline(self):
+        baseline = {'storefront': {'queries': 3, 'p95_ms': 10.0}}
+        self.assertEqual(find_regressions({'storefront': {'queries': 3, 'p95_ms': 19.0}}, baseline), [])
+        self.assertEqual(
+            find_regressions({'storefront': {'queries': 4, 'p95_ms': 25.0}}, baseline),
+            ['storefront: 4 queries, budget 3', 'storefront: p95 25.0ms, baseline 10.0ms'],
+        )
+        # endpoints without a budget are not judged
+        self.assertEqual(find_regressions({'login': {'queries': 9, 'p95_ms': 500.0}}, baseline), [])
+
+
+@override_settings(SESSION_ENGINE='storefront.sessions', SESSION_WRITE_BEHIND_INTERVAL=3600)
+class WriteBehindSessionTests(TestCase):
+    def setUp(self):
+        make_products(3)
+        self.addCleanup(session_writer.flush)
+
+    def stored_cart(self):
+        key = self.client.cookies['sessionid'].value
+        return Session.objects.get(session_key=key).get_decoded().get('cart')
+
+    def test_cart_updates_are_batched_to_the_database(self):
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(4):
+                self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00001'})
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+
+        # served from the cache in the meantime, the database lags behind
+        self.assertEqual(self.client.session['cart'], {'SKU-00000': 1, 'SKU-00001': 4})
+        self.assertEqual(self.stored_cart(), {'SKU-00000': 1})
+
+        self.assertEqual(session_writer.flush(), 1)
+        self.assertEqual(self.stored_cart(), {'SKU-00000': 1, 'SKU-00001': 4})
+
+    def test_evicted_session_is_read_from_the_pending_write(self):
+        session = SessionStore()
+        session['cart'] = {'SKU-00000': 1}
+        session.create()
+        session['cart'] = {'SKU-00000': 5}
+        session.save()
+        self.assertEqual(session_writer.pending_count(), 1)
+
+        # the cache entry is gone (evicted), the database row is still the old cart
+        cache.clear()
+        self.assertEqual(SessionStore(session.session_key)['cart'], {'SKU-00000': 5})
+        self.assertTrue(SessionStore().exists(session.session_key))
+
+        # a save from that read keeps the queued change
+        reloaded = SessionStore(session.session_key)
+        reloaded['cart'] = {**reloaded['cart'], 'SKU-00001': 1}
+        reloaded.save()
+        session_writer.flush()
+        cache.clear()
+        self.assertEqual(SessionStore(session.session_key)['cart'], {'SKU-00000': 5, 'SKU-00001': 1})
+
+    async def test_evicted_session_is_read_from_the_pending_write_async(self):
+        session = SessionStore()
+        session['cart'] = {'SKU-00000': 1}
+        await session.acreate()
+        session['cart'] = {'SKU-00000': 5}
+        await session.asave()
+        await cache.aclear()
+        self.assertEqual(await SessionStore(session.session_key).aget('cart'), {'SKU-00000': 5})
+
+    def test_deleted_session_is_not_written_back(self):
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        key = self.client.cookies['sessionid'].value
+        stale = SessionStore(key)
+        stale['cart'] = {'SKU-00002': 1}
+
+        SessionStore(key).delete()
+        self.assertEqual(session_writer.flush(), 0)
+        with self.assertRaises(UpdateError):
+            stale.save()
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+
+    @override_settings(SESSION_WRITE_BEHIND_INTERVAL=0)
+    def test_zero_interval_writes_through(self):
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        self.assertEqual(self.stored_cart(), {'SKU-00000': 2})
+
+
+class AsyncViewUrls:
+    # the storefront routed to its async views, as STOREFRONT_ASYNC_VIEWS = True does
+    urlpatterns = [path('storefront/', include(storefront_urlpatterns(async_views)))]
+
+
+@override_settings(ROOT_URLCONF=AsyncViewUrls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_products(30)
+        get_search_backend().rebuild()
+
+    async def test_storefront_matches_the_sync_page(self):
+        # the first response sets the CSRF cookie, which is part of the ETag
+        await self.async_client.get(reverse('storefront_home'))
+        response = await self.async_client.get(reverse('storefront_home'), {'category': 'Books'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['product_grid'])
+        self.assertEqual(response.context['total_count'], 30)
+        self.assertContains(response, 'SKU-00003')
+
+        response = await self.async_client.get(
+            reverse('storefront_home'), {'category': 'Books'}, headers={'if-none-match': response['ETag']},
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.async_client.get(reverse('storefront_home'), {'query': 'Product 29'})
+        self.assertContains(response, 'SKU-00029')
+        self.assertNotContains(response, 'SKU-00028')
+
+    async def test_cart_views(self):
+        await self.async_client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        await self.async_client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00000'})
+        await self.async_client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00001'})
+        await self.async_client.post(reverse('update_cart'), {'sku_code': 'SKU-00001', 'quantity': 5})
+        response = await self.async_client.get(reverse('view_cart'))
+        self.assertEqual(response.context['subtotal'], Decimal('0.99') * 2 + Decimal('1.99') * 5)
+
+        response = await self.async_client.post(reverse('remove_from_cart'), {'sku_code': 'SKU-00000'})
+        self.assertRedirects(response, reverse('view_cart'), fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('view_cart'))
+        self.assertEqual([line['product'].sku_code for line in response.context['cart_items']], ['SKU-00001'])
+
+        # a failed checkout leaves the cart alone, its message still beats the 304
+        etag = (await self.async_client.get(reverse('view_cart')))['ETag']
+        await self.async_client.post(reverse('checkout'))
+        response = await self.async_client.get(reverse('view_cart'), headers={'if-none-match': etag})
+        self.assertContains(response, 'not enough stock')
+
+
+class ReadReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        make_products(3)
+
+    def test_product_reads_use_the_replica(self):
+        self.assertEqual(Product.objects.all().db, REPLICA_ALIAS)
+        with CaptureQueriesContext(connections[REPLICA_ALIAS]) as queries:
+            self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(len(queries), 1)
+        # only the catalog is routed
+        self.assertEqual(StockReservation.objects.all().db, 'default')
+
+    def test_writes_and_reads_in_a_transaction_use_default(self):
+        product = Product.objects.get(sku_code='SKU-00000')
+        product.quantity_on_hand = 99
+        product.save()
+        with transaction.atomic():
+            Product.objects.filter(sku_code='SKU-00001').update(quantity_on_hand=42)
+            self.assertEqual(Product.objects.all().db, 'default')
+            self.assertEqual(Product.objects.get(sku_code='SKU-00001').quantity_on_hand, 42)
+        self.assertEqual(Product.objects.get(sku_code='SKU-00000').quantity_on_hand, 99)
+
+    def test_replica_is_read_only(self):
+        with self.assertRaises(DatabaseError):
+            with connections[REPLICA_ALIAS].cursor() as cursor:
+                cursor.execute('DELETE FROM storefront_product')
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_readers_are_not_blocked_by_an_open_write(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        before = Product.objects.get(sku_code='SKU-00002').quantity_on_hand
+        with transaction.atomic():
+            Product.objects.filter(sku_code='SKU-00002').update(quantity_on_hand=before + 1)
+            # the replica keeps reading the last committed version while the write is open
+            self.assertEqual(Product.objects.using(REPLICA_ALIAS).get(sku_code='SKU-00002').quantity_on_hand, before)
+        self.assertEqual(Product.objects.get(sku_code='SKU-00002').quantity_on_hand, before + 1)
+
+
+@override_settings(METRICS_TOKEN='scrape-me')
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        make_products(5)
+        metrics_registry.clear()
+        cache.clear()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('storefront_home'))
+        self.client.post(reverse('add_to_cart'), {'sku_code': 'SKU-00001'})
+
+        response = self.client.get(reverse('metrics'), headers={'authorization': 'Bearer scrape-me'})
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{view="storefront_home"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="storefront_home",le="+Inf"} 1', body)
+        self.assertIn('http_request_phase_seconds_count{phase="template",view="storefront_home"} 1', body)
+        self.assertIn('http_request_phase_seconds_count{phase="db",view="storefront_home"} 1', body)
+        # the cart lives in the session, its queries are reported on their own
+        self.assertIn('http_request_phase_seconds_count{phase="session",view="add_to_cart"} 1', body)
+        self.assertIn('http_responses_total{status="3xx",view="add_to_cart"} 1', body)
+
+    def test_query_count_histogram(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('product_detail', args=['SKU-00001']))
+        body = metrics_registry.render()
+        self.assertIn(f'http_request_db_queries_sum{{view="product_detail"}} {len(queries)}', body)
+
+    def test_metrics_need_the_token(self):
+        url = reverse('metrics')
+        # a local address is not enough, a reverse proxy on the same host would pass that check
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get(url, headers={'authorization': 'Bearer wrong'}).status_code, 404)
+        self.assertEqual(self.client.get(url, headers={'authorization': 'Bearer scrape-me'}).status_code, 200)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(url, headers={'authorization': 'Bearer '}).status_code, 404)
+
+    async def test_async_requests_are_recorded(self):
+        async def get_response(request):
+            pass
+        # under ASGI the middleware runs on the event loop, not adapted through a thread
+        self.assertTrue(iscoroutinefunction(PerformanceMiddleware(get_response)))
+
+        with override_settings(ROOT_URLCONF=AsyncViewUrls):
+            response = await self.async_client.get(reverse('storefront_home'))
+        self.assertEqual(response.status_code, 200)
+        body = metrics_registry.render()
+        self.assertIn('http_request_duration_seconds_count{view="storefront_home"} 1', body)
+        # the async view's queries run in sync_to_async threads and are still counted
+        prefix = 'http_request_db_queries_sum{view="storefront_home"} '
+        line = next(line for line in body.splitlines() if line.startswith(prefix))
+        self.assertGreater(float(line[len(prefix):]), 0)
+
+    @override_settings(METRICS_SLOW_REQUEST_THRESHOLD=0, METRICS_SLOW_REQUEST_QUERIES=1)
+    def test_slow_requests_are_logged_with_their_worst_query(self):
+        with self.assertLogs('aurora_mart_proj.metrics', 'WARNING') as logs:
+            self.client.get(reverse('product_detail', args=['SKU-00001']))
+        message = logs.output[0]
+        self.assertIn('Slow request GET /storefront/product/SKU-00001/ (product_detail)', message)
+        self.assertEqual(message.count('SELECT'), 1)
+
+
+class StockReservationStressTests(TransactionTestCase):
+    # many threads racing for the same few units must never take more than there is
+
+    # the final stock check reads products outside a transaction, i.e. from the replica
+    databases = {'default', 'replica'}
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 25
+    STOCK = 60
+
+    def setUp(self):
+        make_products(2)
+        Product.objects.update(quantity_on_hand=self.STOCK)
+
+    def test_concurrent_reservations_never_oversell(self):
+        results = {'reserved': 0, 'rejected': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(self.ATTEMPTS_PER_THREAD):
+                    try:
+                        reserve_stock({'SKU-00000': 1, 'SKU-00001': 2})
+                        outcome = 'reserved'
+                    except InsufficientStock:
+                        outcome = 'rejected'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        attempts = self.THREADS * self.ATTEMPTS_PER_THREAD
+        logger.info('%d reservation attempts in %.2fs (%.0f/s)', attempts, elapsed, attempts / elapsed)
+
+        self.assertEqual(results['reserved'] + results['rejected'], attempts)
+        # SKU-00001 runs out first: 60 units / 2 per reservation
+        self.assertEqual(results['reserved'], self.STOCK // 2)
+        self.assertEqual(Product.objects.get(sku_code='SKU-00001').quantity_on_hand, 0)
+        self.assertEqual(Product.objects.get(sku_code='SKU-00000').quantity_on_hand, self.STOCK - self.STOCK // 2)
+        self.assertEqual(StockReservation.objects.aggregate(total=Sum('quantity'))['total'], self.STOCK // 2 * 3)
@@ -1,10 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('', views.storefront, name='storefront_home'),
-    path('cart/', views.view_cart, name='view_cart'),
-    path('cart/add/', views.add_to_cart, name='add_to_cart'),
-    path('cart/update/', views.update_cart, name='update_cart'),
-    path('cart/remove/', views.remove_from_cart, name='remove_from_cart'),
-]
\ No newline at end of file
+from . import api, async_views, views
+
+
+def storefront_urlpatterns(page_views):
+    # page_views supplies the page and cart views, views or their native async versions in async_views
+    return [
+        path('', page_views.storefront, name='storefront_home'),
+        path('product/<str:sku_code>/', views.product_detail, name='product_detail'),
+        path('cart/', page_views.view_cart, name='view_cart'),
+        path('cart/add/', page_views.add_to_cart, name='add_to_cart'),
+        path('cart/update/', page_views.update_cart, name='update_cart'),
+        path('cart/remove/', page_views.remove_from_cart, name='remove_from_cart'),
+        path('cart/checkout/', views.checkout, name='checkout'),
+        path('api/products/', api.product_feed, name='product_feed'),
+        path('api/products/<str:sku_code>/related/', api.frequently_bought_together, name='frequently_bought_together'),
+        path('api/suggestions/', api.search_suggestions, name='search_suggestions'),
+        path('api/cart/', api.cart_api, name='cart_api'),
+    ]
+
+
+urlpatterns = storefront_urlpatterns(async_views if settings.STOREFRONT_ASYNC_VIEWS else views)
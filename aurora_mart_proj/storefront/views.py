@@ -1,95 +1,208 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q
 from .models import Product
+from .pagination import get_sort, keyset_page
+from .search import get_search_backend
+from .facets import get_category_facets, get_total_count
+from .associations import related_products
+from .cart import add_item, build_cart_lines, remove_item, set_item_quantity
+from .inventory import InsufficientStock, get_reservation_ttl, release_reservation, reserve_stock
+from .cache import catalog_cache_key, get_catalog_version, get_stock_last_modified, get_stock_version
 import joblib
+import hashlib
 import os
 from django.apps import apps
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-from decimal import Decimal
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.utils.cache import patch_cache_control
 from django.contrib import messages
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# columns rendered by the product cards, the rest (description etc.) comes from product_detail
+LISTING_FIELDS = [
+    'sku_code',
+    'product_name',
+    'quantity_on_hand',
+    'unit_price',
+    'product_rating',
+]
+
+GRID_CACHE_TIMEOUT = 60 * 5
+PRODUCT_CACHE_TIMEOUT = 60 * 60
+# how long browsers/CDNs may reuse a detail response before revalidating with its ETag
+PRODUCT_MAX_AGE = 60
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+def storefront_etag(request, version=None, stock_version=None):
+    # pending flash messages have to be rendered, so those requests never get a 304
+    if len(messages.get_messages(request)):
+        return None
+    # catalog and stock versions + parameters cover the grid, cart and CSRF cookie cover the per-user bits
+    return make_etag(
+        'storefront',
+        version if version is not None else get_catalog_version(),
+        stock_version if stock_version is not None else get_stock_version(),
+        sorted(request.GET.lists()),
+        sorted(request.session.get('cart', {}).items()),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    )
 
 # Create your views here.
+@condition(etag_func=storefront_etag)
 def storefront(request):
     # return HttpResponse("Welcome to Aurora Mart Storefront!")
     query = request.GET.get('query', '')
     active_category = request.GET.get('category')
-    categories = Product.objects.values_list('product_category', flat=True).distinct().order_by('product_category')
-    sort = request.GET.get('sort', 'name-asc')
+    categories = get_category_facets()
+    sort = get_sort(request.GET.get('sort'), query)
     cart = request.session.get('cart', {})
-    cart_item_count = sum(cart.values())
 
-    products = Product.objects.all()
+    # the grid is the same for everyone, only the page around it is per-user
+    product_grid = get_product_grid(active_category, query, sort, request.GET.get('after', ''))
+    return render_storefront(request, categories, product_grid, cart)
 
+def render_storefront(request, categories, product_grid, cart):
+    # shared with the async view in async_views
+    query = request.GET.get('query', '')
+    context = {
+        'product_grid': product_grid,
+        'categories': categories,
+        'total_count': get_total_count(categories),
+        'active_category': request.GET.get('category'),
+        'query': query,
+        'cart_item_count': sum(cart.values()),
+        'sort': get_sort(request.GET.get('sort'), query),
+    }
+    response = render(request, 'storefront.html', context)
+    # per-user page, browsers may keep it but have to revalidate with the ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def filter_products(products, active_category, query):
+    # the category tab and search box filters, shared by the storefront and the catalog API
     if active_category and active_category != 'All':
         products = products.filter(product_category=active_category)
 
     if query:
-        products = products.filter(Q(product_name__icontains=query) | Q(product_category__icontains=query))
-
-    if sort == 'name-asc':
-        products = products.order_by('product_name')
-    elif sort == 'name-desc':
-        products = products.order_by('-product_name')
-    elif sort == 'price-asc':
-        products = products.order_by('unit_price')
-    elif sort == 'price-desc':
-        products = products.order_by('-unit_price')
-    elif sort == 'rating-asc':
-        products = products.order_by('product_rating')
-    elif sort == 'rating-desc':
-        products = products.order_by('-product_rating')
-    
-    context = {
+        products = get_search_backend().search(products, query)
+    return products
+
+def get_product_grid(active_category, query, sort, after):
+    # cached per request parameters, catalog and stock version, any Product write or stock move
+    # starts a fresh set of keys
+    key = catalog_cache_key('grid', active_category or 'All', query, sort, after, get_stock_version())
+    product_grid = cache.get(key)
+    if product_grid is not None:
+        return mark_safe(product_grid)
+
+    # the grid only needs these columns, the rest of the row stays in the database
+    products = filter_products(Product.objects.only(*LISTING_FIELDS), active_category, query)
+
+    # keyset pagination, each page is a bounded range scan no matter how deep the user goes
+    products, next_cursor = keyset_page(products, sort, after)
+
+    product_grid = render_product_grid(products, next_cursor, active_category, query, sort, after)
+    cache.set(key, str(product_grid), getattr(settings, 'STOREFRONT_GRID_CACHE_TIMEOUT', GRID_CACHE_TIMEOUT))
+    return product_grid
+
+def render_product_grid(products, next_cursor, active_category, query, sort, after):
+    return render_to_string('product_grid.html', {
         'products': products,
-        'categories': categories,
         'active_category': active_category,
         'query': query,
-        'cart_item_count': cart_item_count,
         'sort': sort,
-    }
-    return render(request, 'storefront.html', context)
+        'next_cursor': next_cursor,
+        'is_first_page': not after,
+    })
+
+def get_product_detail(sku_code):
+    # plain dict so it can go through any cache backend, one entry per SKU, catalog and stock version
+    key = catalog_cache_key('product', sku_code, get_stock_version())
+    detail = cache.get(key)
+    if detail is None:
+        product = get_object_or_404(Product, sku_code=sku_code)
+        detail = {
+            'sku_code': product.sku_code,
+            'product_name': product.product_name,
+            'product_description': product.product_description,
+            'product_category': product.product_category,
+            'product_subcategory': product.product_subcategory,
+            'quantity_on_hand': product.quantity_on_hand,
+            'unit_price': str(product.unit_price),
+            'product_rating': product.product_rating,
+            'frequently_bought_together': [
+                {'sku_code': related.sku_code, 'product_name': related.product_name, 'unit_price': str(related.unit_price)}
+                for related in related_products([product.sku_code])
+            ],
+        }
+        cache.set(key, detail, getattr(settings, 'STOREFRONT_PRODUCT_CACHE_TIMEOUT', PRODUCT_CACHE_TIMEOUT))
+    return detail
+
+def product_detail_etag(request, sku_code):
+    # only reads the versions, a matching If-None-Match never reaches the database
+    return f"{sku_code}:{request.GET.get('format', 'html')}:{get_catalog_version()}:{get_stock_version()}"
+
+def stock_last_modified(request, *args, **kwargs):
+    return get_stock_last_modified()
+
+@require_GET
+@condition(etag_func=product_detail_etag, last_modified_func=stock_last_modified)
+def product_detail(request, sku_code):
+    product = get_product_detail(sku_code)
+    if request.GET.get('format') == 'json':
+        response = JsonResponse(product)
+    else:
+        response = render(request, 'product_detail.html', {'product': product})
+    # same content for every visitor, so shared caches may keep it too
+    patch_cache_control(response, public=True, max_age=PRODUCT_MAX_AGE)
+    return response
 
 def add_to_cart(request):
     if request.method == "POST":
         sku = request.POST.get("sku_code")
         cart = request.session.get("cart", {})
 
-        cart[sku] = cart.get(sku, 0) + 1
-        request.session["cart"] = cart
+        request.session["cart"] = add_item(cart, sku)
 
         messages.success(request, "Item added to cart!")
         return redirect(request.META.get("HTTP_REFERER", "storefront_home"))
 
+def cart_etag(request, version=None):
+    # same as the storefront, "Item added to cart!" and friends must not be swallowed by a 304
+    if len(messages.get_messages(request)):
+        return None
+    # the cart page shows product names and prices, so the catalog version is part of it too
+    return make_etag(
+        'cart',
+        version if version is not None else get_catalog_version(),
+        sorted(request.session.get('cart', {}).items()),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    )
+
+@condition(etag_func=cart_etag)
 def view_cart(request):
     cart = request.session.get('cart', {})
-    cart_items = []
-    subtotal = Decimal('0.00')
-
-    # Get product objects for SKUs in cart
-    products_in_cart = Product.objects.filter(sku_code__in=cart.keys())
-
-    for product in products_in_cart:
-        sku = product.sku_code
-        quantity = cart[sku]
-        total_item_price = product.unit_price * quantity
-        
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'total_price': total_item_price
-        })
-        subtotal += total_item_price
-    
+    cart_items, subtotal = build_cart_lines(cart)
+    recommendations = related_products(cart.keys()) if cart else []
+    return render_cart(request, cart_items, subtotal, recommendations)
+
+def render_cart(request, cart_items, subtotal, recommendations):
     # For now, total is the same as subtotal
     total = subtotal 
 
     context = {
         'cart_items': cart_items,
+        'recommendations': recommendations,
         'subtotal': subtotal,
         'total': total
     }
-    return render(request, 'cart.html', context)
+    response = render(request, 'cart.html', context)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @require_POST
 def update_cart(request):
@@ -97,17 +210,7 @@ def update_cart(request):
     quantity = int(request.POST.get('quantity', 1))
     cart = request.session.get('cart', {})
     
-    if sku in cart:
-        if quantity > 0:
-            # Optional: Check stock levels again
-            # product = Product.objects.get(sku_code=sku)
-            # if quantity > product.quantity_on_hand: ...
-            cart[sku] = quantity
-        else:
-            # Remove if quantity is 0 or less
-            del cart[sku]
-    
-    request.session['cart'] = cart
+    request.session['cart'] = set_item_quantity(cart, sku, quantity)
     return redirect('view_cart') # Redirect back to the cart page
 
 @require_POST
@@ -115,9 +218,27 @@ def remove_from_cart(request):
     sku = request.POST.get('sku_code')
     cart = request.session.get('cart', {})
     
-    if sku in cart:
-        del cart[sku]
-        
-    request.session['cart'] = cart
+    request.session['cart'] = remove_item(cart, sku)
     return redirect('view_cart')
 
+
+@require_POST
+def checkout(request):
+    # hold the stock for the cart while the customer pays, an earlier hold is given back first
+    cart = request.session.get('cart', {})
+    previous = request.session.pop('reservation', None)
+    if previous:
+        release_reservation(previous)
+    if not cart:
+        return redirect('view_cart')
+
+    try:
+        request.session['reservation'] = reserve_stock(cart)
+    except InsufficientStock as e:
+        product = Product.objects.filter(sku_code=e.sku_code).only('product_name').first()
+        messages.error(request, f"Sorry, there is not enough stock left for {product.product_name if product else e.sku_code}.")
+        return redirect('view_cart')
+
+    minutes = int(get_reservation_ttl().total_seconds() // 60)
+    messages.success(request, f"Your items are reserved for {minutes} minutes.")
+    return redirect('view_cart')